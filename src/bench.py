@@ -0,0 +1,220 @@
+#!/usr/bin/python3.9
+# Mesure des performances des méthodes de géolocalisation.
+# Des réseaux de tailles et de densités croissantes sont générés à partir d'une graine,
+# puis chaque méthode y est appliquée en relevant son temps d'exécution, le nombre
+# d'évaluations de la MSE, le pic de mémoire et l'erreur de localisation.
+
+import argparse
+import csv
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import instrumentation
+from methods import METHODES, apply_method
+from esp8266 import distances_reseau
+from scenarios import generer_reseau
+
+
+# measures compared by `comparer`, for all of them lower is better
+MESURES = ("temps", "evaluations_mse", "pic_memoire", "erreur_moyenne")
+
+
+def reseau(nb_noeuds, densite, *, cote=100.0, seed=0):
+    """
+    Génère un réseau de `nb_noeuds` ESPs à localiser sur un carré de `cote` mètres,
+    avec `densite` ESPs de référence par 100 m².
+
+    Retourne la flotte, ses ESPs de référence, les distances aux références et `dims`.
+    """
+    dims = (0.0, 0.0, cote, cote)
+    nb_references = max(int(round(densite * cote * cote / 100)), 3)
+    fleet = generer_reseau(nb_references, nb_noeuds, dims, seed=seed)
+    ref_esps = fleet.references()
+    distances = distances_reseau(fleet, ref_esps)
+    return fleet, ref_esps, distances, dims
+
+
+def mesurer(fleet, ref_esps, distances, dims, methode, kwargs, *, memoire=True):
+    """
+    Applique `methode` à tout les ESPs de `fleet` qui ne sont pas de référence.
+
+    Retourne le dictionnaire des mesures. Les ESPs hors de portée de tout ESP de référence,
+    que la méthode ne peut localiser, sont comptés dans "echecs" (voir `methods.HorsDePortee`).
+    Toute autre erreur de la méthode est propagée.
+    Le suivi des allocations ralentissant fortement certaines méthodes, le pic de mémoire
+    est relevé lors d'une seconde exécution, et seulement si `memoire` est vrai.
+    """
+    instrumentation.reinitialiser()
+    instrumentation.activer()
+    try:
+        start = time.perf_counter()
+        failures = _localiser(fleet, ref_esps, distances, dims, methode, kwargs)
+        elapsed = time.perf_counter() - start
+    finally:
+        instrumentation.desactiver()
+    counters = instrumentation.snapshot()["compteurs"]
+
+    located = ~fleet.reference & ~np.isnan(fleet.predicted[:, 0])
+    errors = np.hypot(*(fleet.predicted[located] - fleet.coords[located]).T)
+
+    peak = None
+    if memoire:
+        tracemalloc.start()
+        _localiser(fleet, ref_esps, distances, dims, methode, kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "temps": elapsed,
+        "evaluations_mse": counters.get("evaluations_mse", 0),
+        "iterations_optimiseur": counters.get("iterations_optimiseur", 0),
+        "pic_memoire": peak,
+        "erreur_moyenne": float(errors.mean()) if errors.size else None,
+        "erreur_mediane": float(np.median(errors)) if errors.size else None,
+        "erreur_max": float(errors.max()) if errors.size else None,
+        "echecs": failures,
+    }
+
+
+def _localiser(fleet, ref_esps, distances, dims, methode, kwargs):
+    """
+    Localise les ESPs de `fleet` et retourne le nombre d'échecs.
+    """
+    fleet.predicted[:] = np.nan
+    return len(apply_method(fleet, ref_esps, distances, dims, methode, **kwargs))
+
+
+def bench(tailles, densites, *, seed=0, cote=100.0, methodes=None, memoire=True):
+    """
+    Mesure toutes les méthodes (`methods.METHODES` par défaut) pour chaque taille de réseau
+    de `tailles` et chaque densité de `densites`.
+
+    Retourne la liste des résultats, un dictionnaire par méthode et par réseau.
+    """
+    results = []
+    for nb_noeuds in tailles:
+        for densite in densites:
+            network = reseau(nb_noeuds, densite, cote=cote, seed=seed)
+            for name, _, methode, kwargs in methodes or METHODES:
+                print(f"{name}: {nb_noeuds} nodes, {densite} references per 100m²")
+                results.append(
+                    {
+                        "methode": name,
+                        "noeuds": nb_noeuds,
+                        "densite": densite,
+                        **mesurer(*network, methode, kwargs, memoire=memoire),
+                    }
+                )
+    return results
+
+
+def ecrire(results, out_file):
+    """
+    Enregistre `results` dans `out_file`, en CSV si son extension est `.csv` et en JSON sinon.
+    """
+    with open(out_file, "w", newline="") as file:
+        if out_file.endswith(".csv"):
+            writer = csv.DictWriter(file, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            json.dump(results, file, indent=2)
+
+
+def lire(in_file):
+    """
+    Lit des résultats enregistrés par `ecrire`.
+    """
+    with open(in_file, "r", newline="") as file:
+        if not in_file.endswith(".csv"):
+            return json.load(file)
+        return [
+            {
+                key: (value if key == "methode" else float(value) if value else None)
+                for key, value in row.items()
+            }
+            for row in csv.DictReader(file)
+        ]
+
+
+def comparer(results, reference, *, seuil=0.1):
+    """
+    Compare `results` aux résultats `reference` d'une exécution précédente.
+
+    Une mesure de `MESURES` est en régression si elle dépasse celle de référence
+    de plus de `seuil` (en proportion).
+    Retourne la liste des régressions, sous forme de chaînes de caractères.
+    """
+    key = lambda result: (
+        result["methode"],
+        int(result["noeuds"]),
+        float(result["densite"]),
+    )
+    previous = {key(result): result for result in reference}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        for measure in MESURES:
+            if result[measure] is None or old[measure] is None:
+                continue
+            if result[measure] > old[measure] * (1 + seuil):
+                regressions.append(
+                    f"{result['methode']} ({int(result['noeuds'])} nodes, "
+                    f"{result['densite']} references per 100m²): {measure} went from "
+                    f"{old[measure]:.6g} to {result[measure]:.6g}"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark of the localisation methods"
+    )
+    parser.add_argument("--tailles", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--densites", type=float, nargs="+", default=[1.0, 4.0])
+    parser.add_argument("--cote", type=float, default=100.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--methodes",
+        nargs="+",
+        help="names of the methods to run, all of them by default",
+    )
+    parser.add_argument("--sortie", default="bench.json", help=".json or .csv file")
+    parser.add_argument("--reference", help="previous results to compare with")
+    parser.add_argument("--seuil", type=float, default=0.1)
+    parser.add_argument(
+        "--sans-memoire",
+        action="store_true",
+        help="skip the (slow) peak memory measurement",
+    )
+    args = parser.parse_args(argv)
+
+    methodes = [
+        methode
+        for methode in METHODES
+        if args.methodes is None or methode[0] in args.methodes
+    ]
+    results = bench(
+        args.tailles,
+        args.densites,
+        seed=args.seed,
+        cote=args.cote,
+        methodes=methodes,
+        memoire=not args.sans_memoire,
+    )
+    ecrire(results, args.sortie)
+
+    if args.reference is not None:
+        regressions = comparer(results, lire(args.reference), seuil=args.seuil)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# Cache des résultats qui ne dépendent que du réseau.
+# Le calibrage des ESPs de référence et les distances aux ESPs de référence ne changent pas
+# tant que le réseau (positions, caractéristiques), la graine et la tolérance restent les mêmes.
+# Ils sont donc conservés, en mémoire et sur disque, sous une clé calculée à partir
+# du contenu du réseau : relancer les méthodes sur un réseau inchangé ne les recalcule pas.
+
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+import os
+import numpy as np
+from esp8266 import (
+    PORTEE,
+    calibrage_references,
+    distances_en_listes,
+    reference_nodes,
+    tableau_distances,
+)
+from fleet import ESTIMATED_KEYS, PATH_LOSS_KEYS, Fleet
+from matrices import noeuds
+
+
+class CacheReseau:
+    """
+    Cache des paramètres estimés par `esp8266.calibrage_references` et des tables
+    de distances de `esp8266.tableau_distances`.
+
+    Les résultats sont gardés en mémoire, dans la limite de `taille_memoire` octets,
+    et enregistrés dans `directory` (s'il est précisé) dans la limite de `taille_max` octets.
+    Au delà, les résultats les moins récemment utilisés sont oubliés.
+    """
+
+    def __init__(
+        self, directory=None, *, taille_max=256 << 20, taille_memoire=64 << 20
+    ):
+        self.directory = None if directory is None else Path(directory)
+        self.taille_max = taille_max
+        self.taille_memoire = taille_memoire
+        # key -> array, the most recently used last
+        self._memoire = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def calibrage(self, esps, *, epsilon=0.01, seed=None, workers=None):
+        """
+        Calibre les ESPs de référence de `esps`, comme `esp8266.calibrage_references`,
+        à moins que ce réseau n'ait déjà été calibré avec les mêmes `seed` et `epsilon`.
+
+        Sans `seed` le calibrage est aléatoire : il est toujours effectué et n'est pas conservé.
+        """
+        ref_esps = reference_nodes(esps)
+        if seed is None:
+            calibrage_references(esps, epsilon=epsilon, workers=workers)
+            return
+
+        # only the references take part in the calibration
+        key = "calibrage-" + _key(ref_esps, seed, epsilon)
+        params = self._get(key)
+        if params is None:
+            calibrage_references(esps, epsilon=epsilon, seed=seed, workers=workers)
+            params = np.array(
+                [
+                    [esp["estimated_path_loss_params"][k] for k in ESTIMATED_KEYS]
+                    for esp in ref_esps
+                ],
+                dtype=float,
+            )
+            self._set(key, params)
+            return
+
+        for esp, row in zip(ref_esps, params.tolist()):
+            esp["estimated_path_loss_params"] = dict(zip(ESTIMATED_KEYS, row))
+
+    def distances(self, esps, ref_esps):
+        """
+        Les distances de chaque ESP de `esps` qui n'est pas de référence aux `ref_esps`,
+        sous forme d'un dictionnaire id -> liste des distances (voir `esp8266.distances_reseau`).
+        """
+        key = "distances-" + _key(esps, PORTEE, _key(ref_esps))
+        table = self._get(key)
+        if table is None:
+            (ids, table) = tableau_distances(esps, ref_esps)
+            self._set(key, table)
+        else:
+            (ids, _) = noeuds(esps)
+        return dict(zip(ids, distances_en_listes(table)))
+
+    def vider(self):
+        """
+        Oublie tout les résultats, en mémoire et sur disque.
+        """
+        self._memoire.clear()
+        for path in self._fichiers():
+            path.unlink()
+
+    def _get(self, key):
+        if key in self._memoire:
+            self._memoire.move_to_end(key)
+            self.hits += 1
+            return self._memoire[key]
+
+        if self.directory is not None:
+            path = self.directory / f"{key}.npy"
+            if path.exists():
+                # the modification time orders the files for eviction
+                os.utime(path)
+                array = np.load(path)
+                self._garder(key, array)
+                self.hits += 1
+                return array
+
+        self.misses += 1
+        return None
+
+    def _set(self, key, array):
+        self._garder(key, array)
+        if self.directory is None:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{key}.npy"
+        # written aside then renamed, so that other processes never read a partial file
+        partial = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(partial, "wb") as file:
+            np.save(file, array)
+        os.replace(partial, path)
+
+        files = sorted(self._fichiers(), key=lambda path: path.stat().st_mtime)
+        size = sum(path.stat().st_size for path in files)
+        # the file just written is kept, even if it's bigger than the cache
+        for old in files[:-1]:
+            if size <= self.taille_max:
+                break
+            size -= old.stat().st_size
+            old.unlink()
+
+    def _garder(self, key, array):
+        self._memoire[key] = array
+        self._memoire.move_to_end(key)
+        size = sum(array.nbytes for array in self._memoire.values())
+        while size > self.taille_memoire and len(self._memoire) > 1:
+            (_, old) = self._memoire.popitem(last=False)
+            size -= old.nbytes
+
+    def _fichiers(self):
+        if self.directory is None or not self.directory.exists():
+            return []
+        return [
+            path
+            for path in self.directory.glob("*.npy")
+            if path.name.startswith(("calibrage-", "distances-"))
+        ]
+
+
+def _tableau(esps):
+    """
+    Le contenu de `esps` (id, type, coordonnées et caractéristiques) sous forme d'un tableau.
+    """
+    if isinstance(esps, Fleet):
+        return np.column_stack(
+            (
+                esps.ids,
+                esps.reference,
+                esps.coords,
+                *(getattr(esps, key) for key in PATH_LOSS_KEYS),
+            )
+        ).astype(float)
+    return np.array(
+        [
+            (
+                esp["id"],
+                esp["reference_node"],
+                *esp["coordinates"],
+                *(esp["path_loss_params"][key] for key in PATH_LOSS_KEYS),
+            )
+            for esp in esps
+        ],
+        dtype=float,
+    ).reshape(-1, 4 + len(PATH_LOSS_KEYS))
+
+
+def _key(esps, *params):
+    digest = hashlib.sha1(_tableau(esps).tobytes())
+    digest.update(repr(params).encode())
+    return digest.hexdigest()[:16]
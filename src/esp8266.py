@@ -1,5 +1,14 @@
 from utils import *
 from math import log10
+import numpy as np
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import instrumentation
+import matrices
+
+
+# au delà de cette distance (en mètres) les mesures ne sont plus fiables
+PORTEE = 20
 
 
 def mean_power(distance, loss_params):
@@ -8,7 +17,9 @@ def mean_power(distance, loss_params):
     `loss_params` (voir la clé "path_loss_params" d'un ESP) à une distance
     `distance` d'un autre ESP.
     """
-    return loss_params["P0"] - 10 * loss_params["gamma"] * log10(distance)
+    return loss_params["P0"] - 10 * loss_params["gamma"] * log10(
+        distance / loss_params["d0"]
+    )
 
 
 def path_loss_params_estimation(s1, s2):
@@ -26,8 +37,10 @@ def path_loss_params_estimation(s1, s2):
     # arbitrarely chosen
     d0 = 1
 
-    gamma = p1 - p2 / (10 * log10(d2 / d1))
-    p0 = (p1 + p2 + 20 * gamma * log10((d1 * d2) / (d0 ** 2))) / 2
+    # p1 - p2 = 10 * gamma * log10(d2 / d1)
+    gamma = (p1 - p2) / (10 * log10(d2 / d1))
+    # p1 + p2 = 2 * P0 - 10 * gamma * log10(d1 * d2 / d0²)
+    p0 = (p1 + p2 + 10 * gamma * log10((d1 * d2) / (d0 ** 2))) / 2
 
     return (p0, d0, gamma)
 
@@ -39,95 +52,484 @@ def reference_nodes(esps):
     return [esp for esp in esps if esp["reference_node"]]
 
 
-def deux_plus_proches_voisins(ref_esp, esps):
+def deux_plus_proches_voisins(ref_esp, esps, index=None):
     """
     Détermine les deux plus proches voisins de `ref_esp`
 
+    Si `index` est fourni, il doit s'agir d'un `spatial.SpatialIndex` construit sur `esps`,
+    ce qui évite de trier l'ensemble des ESPs.
+
     Retourne un tuple contenant ces deux plus proches voisins.
     S'il existe plusieurs voisins à la même distance, seul l'un d'eux est
     sélectionné.
     """
     ref_pos = ref_esp["coordinates"]
+    if index is not None:
+        return [esps[i] for i in index.plus_proches_voisins(ref_pos, 3)[1:3]]
     # we don't take the first element since it would be itself
     # indeed the distance to oneself is always 0
     return sorted(esps, key=lambda esp: distance(esp["coordinates"], ref_pos))[1:3]
 
 
-def signal_moyen(emetteur, receveur, *, epsilon=0.01):
+def signal_moyen(
+    emetteur, receveur, *, epsilon=0.01, rng=None, metrics=None, pilote=None
+):
     """
     Détermine le signal moyen reçu par `receveur` et émis par `emetteur`
 
     La tolérance est fixée à `epsilon`.
+    Les signaux sont simulés par le générateur numpy `rng`, créé s'il n'est pas fourni.
+    Seule leur moyenne glissante est conservée (voir `utils.RunningStats`).
+    Si un `pilote` (voir `pilotes.py`) est fourni, les signaux lui sont plutôt demandés
+    (voir `signal_moyen_async`).
+
+    Si `metrics` (un dictionnaire) est fourni, le nombre de signaux émis y est enregistré
+    sous la clé (id de l'émetteur, id du receveur).
     """
-    d = distance(emetteur["coordinates"], receveur["coordinates"])
-    # we start we 16 values
-    amount = 16
+    if pilote is not None:
+        return _avec_pilote(
+            pilote,
+            signal_moyen_async(
+                emetteur, receveur, pilote, epsilon=epsilon, metrics=metrics
+            ),
+        )
 
+    d = distance(emetteur["coordinates"], receveur["coordinates"])
     real_mean = mean_power(d, emetteur["path_loss_params"])
     sigma = emetteur["path_loss_params"]["sigma"]
-    signals = get_signals(
-        amount,
-        real_mean,
-        sigma,
+    if rng is None:
+        rng = np.random.default_rng()
+    return _signal_simule(
+        emetteur["id"], receveur["id"], real_mean, sigma, epsilon, rng, metrics
     )
 
-    mean = expectancy(signals)
+
+def _signal_simule(emetteur_id, receveur_id, real_mean, sigma, epsilon, rng, metrics):
+    """
+    Le coeur de `signal_moyen`, pour un lien de puissance moyenne `real_mean` déjà connue.
+    """
+    stats = RunningStats()
+    for amount in _quantites(stats, epsilon):
+        stream_signals(stats, rng, amount, real_mean, sigma)
+    _signal_mesure(emetteur_id, receveur_id, stats, metrics)
+    return stats.mean
+
+
+async def signal_moyen_async(emetteur, receveur, pilote, *, epsilon=0.01, metrics=None):
+    """
+    Version asynchrone de `signal_moyen`, dont les signaux sont demandés au `pilote`.
+
+    Les signaux arrivent par lots, sans être tous gardés en mémoire. Plusieurs liens
+    peuvent ainsi être mesurés simultanément (voir `calibrage_references`).
+    """
+    stats = RunningStats()
+    for amount in _quantites(stats, epsilon):
+        async for signals in pilote.signaux(emetteur, receveur, amount):
+            stats.update(signals)
+    _signal_mesure(emetteur["id"], receveur["id"], stats, metrics)
+    return stats.mean
+
+
+def _quantites(stats, epsilon):
+    """
+    Les nombres de signaux à ajouter successivement à `stats`, jusqu'à ce que
+    la moyenne varie de moins de `epsilon` d'un ajout à l'autre.
+    """
+    # we start we 16 values
+    amount = 16
+    yield amount
+    mean = stats.mean
 
     while True:
-        signals.extend(
-            get_signals(
-                amount,
-                real_mean,
-                sigma,
-            )
-        )
-        new_mean = expectancy(signals)
-        if abs(new_mean - mean) <= epsilon:
-            print(
-                f"""Node {emetteur["id"]} had to emit {amount} signals for node {receveur["id"]}"""
-            )
-            return new_mean
-        else:
-            mean = new_mean
+        yield amount
+        if abs(stats.mean - mean) <= epsilon:
+            return
+        mean = stats.mean
         amount *= 2
 
 
-def calibrage_references(esps):
+def _signal_mesure(emetteur_id, receveur_id, stats, metrics):
+    """
+    Enregistre le nombre de signaux émis pour un lien dans `metrics` et l'instrumentation.
+    """
+    if metrics is not None:
+        metrics[(emetteur_id, receveur_id)] = stats.count
+    if instrumentation.actif:
+        instrumentation.compter("signaux_emis", stats.count)
+        instrumentation.enregistrer(
+            "signaux_par_lien", f"{emetteur_id}->{receveur_id}", stats.count
+        )
+
+
+def _avec_pilote(pilote, coroutine):
+    """
+    Exécute `coroutine` dans une boucle d'évènements, puis ferme les connexions du `pilote`
+    (qui ne peuvent servir à une autre boucle).
+    """
+
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await pilote.fermer()
+
+    return asyncio.run(run())
+
+
+def link_rng(seed, emetteur, receveur):
+    """
+    Le générateur aléatoire propre au lien entre `emetteur` et `receveur`.
+
+    Il ne dépend que de `seed` et des identifiants des deux ESPs, ce qui rend
+    les signaux simulés pour un lien indépendants de l'ordre des calculs.
+    """
+    return _rng_lien(seed, emetteur["id"], receveur["id"])
+
+
+def _rng_lien(seed, emetteur_id, receveur_id):
+    return np.random.default_rng([seed, emetteur_id, receveur_id])
+
+
+def calibrage_references(
+    esps,
+    *,
+    epsilon=0.01,
+    seed=None,
+    workers=None,
+    metrics=None,
+    ids=None,
+    pilote=None,
+    index=None,
+):
     """
     Calibre parmi `esps` les ESPs de référence entre eux.
 
+    `esps` peut être une liste d'ESPs ou une `fleet.Fleet`.
     Cette fonction modifie les ESPs en place.
+
+    Chaque lien émetteur/receveur a son propre générateur (voir `link_rng`) dérivé de `seed`,
+    le résultat est donc identique quel que soit le nombre de processus `workers`.
+    Si `workers` vaut plus de 1 les ESPs de référence sont répartis entre autant de processus.
+    `metrics` est transmis à `signal_moyen`.
+    Si `ids` est précisé, seuls les ESPs de référence dont l'id en fait partie sont calibrés
+    (leurs voisins restant cherchés parmi tout les ESPs de référence).
+    `index` est un `spatial.SpatialIndex` des ESPs de référence de `esps` (dans leur ordre),
+    construit ici s'il n'est pas fourni.
+
+    Si un `pilote` (voir `pilotes.py`) est fourni, les signaux lui sont demandés et tout
+    les liens sont mesurés simultanément, dans une boucle d'évènements (`seed` et `workers`
+    ne servent alors pas).
     """
     ref_esps = reference_nodes(esps)
     assert len(ref_esps) >= 3, "At least three reference nodes are needed to calibrate"
 
-    for esp in ref_esps:
-        esp1, esp2 = deux_plus_proches_voisins(esp, ref_esps)
-        d1 = distance(esp1["coordinates"], esp["coordinates"])
-        d2 = distance(esp2["coordinates"], esp["coordinates"])
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    if index is None:
+        # imported here, scipy is slow to import
+        from spatial import SpatialIndex
+
+        index = SpatialIndex(ref_esps)
+    targets = [esp for esp in ref_esps if ids is None or esp["id"] in ids]
+    neighbourhoods = [
+        (esp, *deux_plus_proches_voisins(esp, ref_esps, index)) for esp in targets
+    ]
+
+    with instrumentation.chronometre("calibrage"):
+        if pilote is not None:
+            tasks = [
+                ([_link_endpoint(node) for node in nodes], epsilon)
+                for nodes in neighbourhoods
+            ]
+            results = _avec_pilote(pilote, _calibrages_async(tasks, pilote))
+        else:
+            tasks = _taches_calibrage(neighbourhoods, seed, epsilon)
+            if workers is None or workers <= 1:
+                results = [_calibrage_reference(task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    chunksize = max(1, len(tasks) // (4 * workers))
+                    results = list(
+                        executor.map(_calibrage_reference, tasks, chunksize=chunksize)
+                    )
+
+    for esp, (params, link_metrics, measures) in zip(targets, results):
+        esp["estimated_path_loss_params"] = params
+        if metrics is not None:
+            metrics.update(link_metrics)
+        if instrumentation.actif and measures is not None:
+            instrumentation.fusionner(measures)
+
+
+def _taches_calibrage(neighbourhoods, seed, epsilon):
+    """
+    Les tâches de `_calibrage_reference`, une par ESP de référence à calibrer suivi
+    de ses deux plus proches voisins dans `neighbourhoods`.
+
+    Les distances et puissances moyennes des liens sont calculées ici, seuls les nombres
+    utiles sont envoyés aux processus. Elles le sont comme par les pilotes (voir `pilotes.py`)
+    afin que le calibrage donne les mêmes caractéristiques avec ou sans pilote.
+    """
+    tasks = []
+    for esp, *neighbours in neighbourhoods:
+        params = esp["path_loss_params"]
+        d = tuple(
+            distance(neighbour["coordinates"], esp["coordinates"])
+            for neighbour in neighbours
+        )
+        tasks.append(
+            (
+                (esp["id"], *(neighbour["id"] for neighbour in neighbours)),
+                d,
+                tuple(mean_power(di, params) for di in d),
+                params["sigma"],
+                seed,
+                epsilon,
+                instrumentation.actif,
+            )
+        )
+    return tasks
 
-        sig1 = signal_moyen(esp, esp1)
-        sig2 = signal_moyen(esp, esp2)
-        (P0, d0, gamma) = path_loss_params_estimation((d1, sig1), (d2, sig2))
-        esp["estimated_path_loss_params"] = {"P0": P0, "d0": d0, "gamma": gamma}
 
+def _link_endpoint(esp):
+    return {
+        "id": esp["id"],
+        "coordinates": esp["coordinates"],
+        "path_loss_params": dict(esp["path_loss_params"]),
+    }
 
-def distances_aux_references(esp, ref_esps):
+
+async def _calibrages_async(tasks, pilote):
+    return await asyncio.gather(
+        *(_calibrage_reference_async(task, pilote) for task in tasks)
+    )
+
+
+async def _calibrage_reference_async(task, pilote):
+    """
+    Version asynchrone de `_calibrage_reference`, dont les signaux sont demandés au `pilote`.
+
+    Les mesures de l'instrumentation sont directement faites dans ce processus.
+    """
+    (esp, esp1, esp2), epsilon = task
+    d1 = distance(esp1["coordinates"], esp["coordinates"])
+    d2 = distance(esp2["coordinates"], esp["coordinates"])
+
+    link_metrics = {}
+    (sig1, sig2) = await asyncio.gather(
+        signal_moyen_async(esp, esp1, pilote, epsilon=epsilon, metrics=link_metrics),
+        signal_moyen_async(esp, esp2, pilote, epsilon=epsilon, metrics=link_metrics),
+    )
+    (P0, d0, gamma) = path_loss_params_estimation((d1, sig1), (d2, sig2))
+    return {"P0": P0, "d0": d0, "gamma": gamma}, link_metrics, None
+
+
+def _calibrage_reference(task):
+    """
+    Calibre un ESP de référence à partir de ses deux plus proches voisins.
+
+    Retourne les caractéristiques estimées, le nombre de signaux émis par lien
+    et les mesures de l'instrumentation (voir `instrumentation.isoler`).
+    """
+    (ids, (d1, d2), means, sigma, seed, epsilon, instrumented) = task
+    (esp_id, *neighbour_ids) = ids
+
+    link_metrics = {}
+    # this may run in another process, whose measures are sent back
+    with instrumentation.isoler(instrumented) as measures:
+        (sig1, sig2) = [
+            _signal_simule(
+                esp_id,
+                neighbour_id,
+                mean,
+                sigma,
+                epsilon,
+                _rng_lien(seed, esp_id, neighbour_id),
+                link_metrics,
+            )
+            for neighbour_id, mean in zip(neighbour_ids, means)
+        ]
+    (P0, d0, gamma) = path_loss_params_estimation((d1, sig1), (d2, sig2))
+    return {"P0": P0, "d0": d0, "gamma": gamma}, link_metrics, measures
+
+
+def distances_aux_references(esp, ref_esps, index=None):
     """
     La distance de `esp` à l'ensemble des ESPs de référence (`ref_esps`)
 
-    Si la distance entre l'ESP étudié et un ESP de référence est supérieure à 20m,
+    Si la distance entre l'ESP étudié et un ESP de référence est supérieure à `PORTEE` (20m),
     la distance est plutôt fixée à `None` car il n'est plus possible
     de considérer les mesures comme fiables.
 
+    Si `index` est fourni, il doit s'agir d'un `spatial.SpatialIndex` construit sur `ref_esps`
+    afin de ne calculer que les distances aux ESPs à portée.
+
     Retourne une liste des distances, chaque élément correspondant à la distance entre `esp`
     et l'élément de même indice de `ref_esps`.
     """
     esp_pos = esp["coordinates"]
-    return [
-        dist if 20 >= (dist := distance(esp_pos, ref_esp["coordinates"])) else None
-        for ref_esp in ref_esps
-    ]
+    if index is not None:
+        # same expression and conversion as below, so that both give the same floats
+        near = index.dans_le_rayon(esp_pos, PORTEE)
+        table = matrices.matrice_distances(
+            [esp_pos], index.coords[near], portee=PORTEE
+        )
+        distances = [None] * len(ref_esps)
+        for i, d in zip(near.tolist(), distances_en_listes(table)[0]):
+            distances[i] = d
+        return distances
+
+    table = matrices.matrice_distances(
+        [esp_pos], matrices.coordonnees(ref_esps), portee=PORTEE
+    )
+    return distances_en_listes(table)[0]
+
+
+def tableau_distances(esps, ref_esps, *, out=None, memoire=matrices.MEMOIRE_BLOC):
+    """
+    Les distances de chaque ESP de `esps` qui n'est pas de référence aux `ref_esps`,
+    calculées d'un seul passage (voir `matrices.matrice_distances`).
+
+    `esps` peut être une liste d'ESPs ou une `fleet.Fleet`.
+    Retourne la liste des ids de ces ESPs et le tableau (N, M) de leurs distances,
+    dans le même ordre. Les distances supérieures à `PORTEE` valent `nan`.
+    """
+    (ids, coords) = matrices.noeuds(esps)
+    table = matrices.matrice_distances(
+        coords, matrices.coordonnees(ref_esps), portee=PORTEE, out=out, memoire=memoire
+    )
+    return ids, table
+
+
+def distances_reseau(esps, ref_esps, *, memoire=matrices.MEMOIRE_BLOC):
+    """
+    `distances_aux_references` pour chaque ESP de `esps` qui n'est pas de référence,
+    sous forme d'un dictionnaire id -> liste des distances.
+
+    Les distances sont calculées par blocs (voir `tableau_distances`) et converties
+    au fur et à mesure : seul le dictionnaire est gardé en entier.
+    """
+    (ids, coords) = matrices.noeuds(esps)
+    ref_coords = matrices.coordonnees(ref_esps)
+    distances = {}
+    for rows in matrices.blocs(len(coords), len(ref_coords), memoire=memoire):
+        table = matrices.matrice_distances(coords[rows], ref_coords, portee=PORTEE)
+        distances.update(zip(ids[rows], distances_en_listes(table)))
+    return distances
+
+
+def distances_en_listes(table):
+    """
+    Convertit le tableau de distances `table` (voir `tableau_distances`) en listes,
+    une par ligne, où les distances `nan` (hors de portée) sont remplacées par `None`.
+    """
+    rows = table.astype(object)
+    rows[np.isnan(table)] = None
+    return rows.tolist()
+
+
+def references_arrays(ref_esps, distances):
+    """
+    Convertit `ref_esps` et `distances` en tableaux utilisables par `MSE_batch`.
+
+    `ref_esps` et `distances` doivent être ordonnées identiquement, voir `distances_aux_references`.
+
+    Retourne un tuple (coordonnées, distances) où les coordonnées forment un tableau (M, 2)
+    et les distances un tableau (M,). Les distances valant `None` (ESP trop lointain)
+    sont représentées par `nan`.
+    """
+    assert len(ref_esps) == len(
+        distances
+    ), "ref_esps and distances must have as many elements, and have the same order"
+
+    ref_coords = np.array(
+        [ref_esp["coordinates"] for ref_esp in ref_esps], dtype=float
+    ).reshape(-1, 2)
+    ref_distances = np.array(
+        [np.nan if dist is None else dist for dist in distances], dtype=float
+    )
+    return ref_coords, ref_distances
+
+
+def MSE_batch(positions, ref_coords, ref_distances):
+    """
+    Version vectorisée de `MSE` évaluant K positions candidates à la fois.
+
+    `positions` est un tableau (K, 2) (ou une unique position (x, y))
+    `ref_coords` est un tableau (M, 2) des coordonnées des ESPs de référence
+    `ref_distances` est un tableau (M,) des distances mesurées, `nan` pour les ESPs trop lointains
+    Ces deux derniers tableaux sont obtenus avec `references_arrays`.
+
+    Retourne un tableau (K,) des scores. Si tout les ESPs sont trop loin, tout les scores valent -1.0.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    ref_distances = np.asarray(ref_distances, dtype=float)
+    if instrumentation.actif:
+        instrumentation.compter("evaluations_mse", len(positions))
+
+    usable = ~np.isnan(ref_distances)
+    if not usable.any():
+        # same dummy value as `MSE` to denote the incapacity to calculate the score
+        return np.full(len(positions), -1.0)
+
+    coords = np.asarray(ref_coords, dtype=float).reshape(-1, 2)[usable]
+    # (K, M) matrix of the distances between candidates and references
+    measured = np.hypot(
+        positions[:, 0, None] - coords[None, :, 0],
+        positions[:, 1, None] - coords[None, :, 1],
+    )
+    return ((ref_distances[usable] - measured) ** 2).mean(axis=1)
+
+
+def usable_references(ref_coords, ref_distances):
+    """
+    Ne garde de `ref_coords` et `ref_distances` (voir `references_arrays`)
+    que les ESPs de référence à portée.
+    """
+    ref_distances = np.asarray(ref_distances, dtype=float)
+    usable = ~np.isnan(ref_distances)
+    ref_coords = np.asarray(ref_coords, dtype=float).reshape(-1, 2)
+    return ref_coords[usable], ref_distances[usable]
+
+
+def residuals(pos, ref_coords, ref_distances):
+    """
+    Le vecteur des écarts entre les distances attendues depuis `pos` et les distances mesurées.
+
+    Les arguments sont ceux de `MSE_batch` pour une unique position, les ESPs hors de portée
+    sont écartés. La `MSE` est la moyenne des carrés de ce vecteur.
+    """
+    coords, real = usable_references(ref_coords, ref_distances)
+    return np.hypot(pos[0] - coords[:, 0], pos[1] - coords[:, 1]) - real
+
+
+def residuals_jacobian(pos, ref_coords, ref_distances):
+    """
+    La jacobienne (M, 2) de `residuals` en `pos`.
+
+    Chaque ligne est le vecteur unitaire allant de l'ESP de référence vers `pos`
+    (nul si `pos` est confondu avec l'ESP de référence).
+    """
+    coords, _ = usable_references(ref_coords, ref_distances)
+    offsets = np.asarray(pos, dtype=float)[None, :] - coords
+    norms = np.hypot(offsets[:, 0], offsets[:, 1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(norms[:, None] > 0, offsets / norms[:, None], 0.0)
+
+
+def MSE_gradient(pos, ref_coords, ref_distances):
+    """
+    Le gradient de la `MSE` en `pos`, calculé analytiquement.
+
+    Les arguments sont ceux de `MSE_batch` pour une unique position.
+    Si tout les ESPs sont trop loin, la MSE est constante et le gradient est nul.
+    """
+    pos = np.asarray(pos, dtype=float)
+    res = residuals(pos, ref_coords, ref_distances)
+    if res.size == 0:
+        return np.zeros(2)
+    return 2 * residuals_jacobian(pos, ref_coords, ref_distances).T @ res / res.size
 
 
 def MSE(pos, ref_esps, distances):
@@ -148,26 +550,7 @@ def MSE(pos, ref_esps, distances):
     Retourne le score, soit le carré de la différence entre la valeur attendue et la valeur mesurée.
     Si tout les ESPs sont trop loin de `esp`, retourne -1.0.
     """
-    assert (node_nbr := len(ref_esps)) == len(
-        distances
-    ), "ref_esps and distances must have as many elements, and have the same order"
-
-    count = 0
-    score = 0
-    for ref_esp, real_distance in zip(ref_esps, distances):
-        if real_distance is not None:
-            measured_distance = distance(pos, ref_esp["coordinates"])
-            score += (real_distance - measured_distance) ** 2
-            count += 1
-
-    try:
-        score /= count
-    # if all distances were `None` then the count is 0, hence the exception
-    # we then use -1.0 as the dummy value to denote the incapacity to calculate the MSE
-    except ZeroDivisionError:
-        score = -1.0
-
-    return score
+    return float(MSE_batch(pos, *references_arrays(ref_esps, distances))[0])
 
 
 def new_esp(identifier, dims, ref=False):
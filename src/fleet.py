@@ -0,0 +1,346 @@
+# Représentation compacte d'un ensemble d'ESPs.
+# Plutôt qu'un dictionnaire par ESP, les caractéristiques de tout les ESPs sont
+# rangées dans des tableaux contigus (une colonne par caractéristique).
+# Des vues légères permettent d'utiliser la flotte avec les fonctions
+# qui manipulent des ESPs sous forme de dictionnaires (c.f. `esp8266.py`).
+
+from collections.abc import MutableMapping
+from pathlib import Path
+import numpy as np
+from utils import iter_csv
+
+
+PATH_LOSS_KEYS = ("P0", "d0", "gamma", "sigma")
+ESTIMATED_KEYS = ("P0", "d0", "gamma")
+# arrays making up a fleet, in the order they are saved
+COLUMNS = (
+    "ids",
+    "coords",
+    *PATH_LOSS_KEYS,
+    "reference",
+    "predicted",
+    "estimated",
+)
+
+
+class Fleet:
+    """
+    Flotte d'ESPs stockée colonne par colonne.
+
+    - `ids` : tableau (N,) des identifiants
+    - `coords` : tableau (N, 2) des coordonnées (x, y)
+    - `P0`, `d0`, `gamma`, `sigma` : tableaux (N,) des caractéristiques ("path_loss_params")
+    - `reference` : masque (N,) des noeuds de référence
+    - `predicted` : tableau (N, 2) des positions estimées, `nan` si absente
+    - `estimated` : tableau (N, 3) des caractéristiques estimées (P0, d0, gamma), `nan` si absentes
+
+    `dtype` permet de choisir la précision du stockage (`np.float32` divise la mémoire par deux).
+    Sans `predicted` ni `estimated`, aucun ESP n'a de position ni de caractéristiques estimées.
+    """
+
+    def __init__(
+        self,
+        ids,
+        coords,
+        P0,
+        d0,
+        gamma,
+        sigma,
+        reference,
+        dtype=np.float64,
+        *,
+        predicted=None,
+        estimated=None,
+    ):
+        self.dtype = np.dtype(dtype)
+        self.ids = np.ascontiguousarray(ids, dtype=np.int64)
+        count = len(self.ids)
+        self.coords = np.ascontiguousarray(coords, dtype=self.dtype).reshape(count, 2)
+        self.P0 = np.ascontiguousarray(P0, dtype=self.dtype)
+        self.d0 = np.ascontiguousarray(d0, dtype=self.dtype)
+        self.gamma = np.ascontiguousarray(gamma, dtype=self.dtype)
+        self.sigma = np.ascontiguousarray(sigma, dtype=self.dtype)
+        self.reference = np.ascontiguousarray(reference, dtype=bool)
+        self.predicted = _colonne(predicted, (count, 2), self.dtype)
+        self.estimated = _colonne(estimated, (count, 3), self.dtype)
+        self._rows = None
+
+    @classmethod
+    def from_esps(cls, esps, dtype=np.float64):
+        """
+        Construit une flotte à partir d'une liste d'ESPs (voir `esp8266.to_esp`).
+
+        Les clés optionnelles "predicted_position" et "estimated_path_loss_params"
+        sont conservées.
+        """
+        fleet = cls(
+            [esp["id"] for esp in esps],
+            [esp["coordinates"] for esp in esps],
+            *(
+                [esp["path_loss_params"][key] for esp in esps]
+                for key in PATH_LOSS_KEYS
+            ),
+            [esp["reference_node"] for esp in esps],
+            dtype=dtype,
+        )
+        for view, esp in zip(fleet, esps):
+            for key in ("predicted_position", "estimated_path_loss_params"):
+                if key in esp:
+                    view[key] = esp[key]
+        return fleet
+
+    @classmethod
+    def from_csv(cls, file_name, *, chunksize=1 << 16, dtype=np.float64):
+        """
+        Construit une flotte à partir du CSV `file_name` (voir `utils.read_csv`).
+
+        Le fichier est lu deux fois : une première fois pour compter les ESPs afin
+        d'allouer les tableaux une seule fois, puis par blocs (voir `utils.iter_csv`)
+        pour les remplir. Aucun dictionnaire n'est construit.
+        """
+        with open(file_name, "r") as file:
+            count = sum(1 for line in file if not line.startswith("#") and line.strip())
+
+        fleet = cls(
+            np.zeros(count, dtype=np.int64),
+            np.zeros((count, 2)),
+            *(np.zeros(count) for _ in PATH_LOSS_KEYS),
+            np.zeros(count, dtype=bool),
+            dtype=dtype,
+        )
+        start = 0
+        for columns in iter_csv(file_name, chunksize):
+            stop = start + len(columns["id"])
+            fleet.ids[start:stop] = columns["id"]
+            fleet.coords[start:stop, 0] = columns["x"]
+            fleet.coords[start:stop, 1] = columns["y"]
+            for key in PATH_LOSS_KEYS:
+                getattr(fleet, key)[start:stop] = columns[key]
+            fleet.reference[start:stop] = columns["ref"]
+            start = stop
+        return fleet
+
+    def save(self, directory):
+        """
+        Enregistre la flotte dans `directory`, un fichier `.npy` par tableau (voir `load`).
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in COLUMNS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, *, mmap_mode="r"):
+        """
+        Ouvre une flotte enregistrée par `save`.
+
+        Par défaut les tableaux sont projetés en mémoire : l'ouverture est immédiate et
+        seules les pages lues sont chargées. Les positions et caractéristiques estimées
+        restent modifiables sans que le fichier ne le soit (copie à l'écriture).
+        `mmap_mode=None` charge entièrement la flotte en mémoire.
+        """
+        directory = Path(directory)
+        arrays = {
+            name: np.load(
+                directory / f"{name}.npy",
+                mmap_mode=(
+                    "c"
+                    if mmap_mode == "r" and name in ("predicted", "estimated")
+                    else mmap_mode
+                ),
+            )
+            for name in COLUMNS
+        }
+        return cls(
+            arrays["ids"],
+            arrays["coords"],
+            *(arrays[key] for key in PATH_LOSS_KEYS),
+            arrays["reference"],
+            dtype=arrays["coords"].dtype,
+            predicted=arrays["predicted"],
+            estimated=arrays["estimated"],
+        )
+
+    def to_esps(self):
+        """
+        Retourne la flotte sous forme d'une liste de dictionnaires indépendants.
+        """
+        return [view.to_dict() for view in self]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return ESPView(self, i)
+
+    def __iter__(self):
+        return (ESPView(self, i) for i in range(len(self)))
+
+    def row(self, identifier):
+        """
+        L'indice de l'ESP d'identifiant `identifier` dans les tableaux de la flotte.
+        """
+        if self._rows is None:
+            self._rows = {int(identifier): i for i, identifier in enumerate(self.ids)}
+        return self._rows[identifier]
+
+    def by_id(self, identifier):
+        """
+        La vue de l'ESP d'identifiant `identifier`.
+        """
+        return ESPView(self, self.row(identifier))
+
+    def references(self):
+        """
+        Les vues des ESPs de référence, dans l'ordre de la flotte.
+        """
+        return [ESPView(self, i) for i in np.flatnonzero(self.reference)]
+
+    @property
+    def nbytes(self):
+        """
+        La mémoire occupée par les tableaux de la flotte, en octets.
+        """
+        return sum(
+            array.nbytes
+            for array in (
+                self.ids,
+                self.coords,
+                self.P0,
+                self.d0,
+                self.gamma,
+                self.sigma,
+                self.reference,
+                self.predicted,
+                self.estimated,
+            )
+        )
+
+
+class ESPView(MutableMapping):
+    """
+    Vue d'un ESP d'une `Fleet`, qui se comporte comme le dictionnaire d'un ESP.
+
+    Aucune donnée n'est copiée : la lecture et l'écriture des clés se font
+    directement dans les tableaux de la flotte.
+    """
+
+    __slots__ = ("fleet", "row")
+
+    def __init__(self, fleet, row):
+        self.fleet = fleet
+        self.row = int(row)
+
+    def __getitem__(self, key):
+        fleet, i = self.fleet, self.row
+        if key == "id":
+            return int(fleet.ids[i])
+        if key == "coordinates":
+            return (float(fleet.coords[i, 0]), float(fleet.coords[i, 1]))
+        if key == "reference_node":
+            return bool(fleet.reference[i])
+        if key == "path_loss_params":
+            return _ParamsView(self, PATH_LOSS_KEYS)
+        if key == "predicted_position" and not np.isnan(fleet.predicted[i, 0]):
+            return (float(fleet.predicted[i, 0]), float(fleet.predicted[i, 1]))
+        if key == "estimated_path_loss_params" and not np.isnan(fleet.estimated[i, 0]):
+            return _ParamsView(self, ESTIMATED_KEYS)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        fleet, i = self.fleet, self.row
+        if key == "id":
+            fleet.ids[i] = value
+            fleet._rows = None
+        elif key == "coordinates":
+            fleet.coords[i] = value
+        elif key == "reference_node":
+            fleet.reference[i] = value
+        elif key == "path_loss_params":
+            for param in PATH_LOSS_KEYS:
+                getattr(fleet, param)[i] = value[param]
+        elif key == "predicted_position":
+            fleet.predicted[i] = value
+        elif key == "estimated_path_loss_params":
+            fleet.estimated[i] = [value[param] for param in ESTIMATED_KEYS]
+        else:
+            raise KeyError(f"ESP views can't hold the {key!r} key")
+
+    def __delitem__(self, key):
+        if key == "predicted_position" and key in self:
+            self.fleet.predicted[self.row] = np.nan
+        elif key == "estimated_path_loss_params" and key in self:
+            self.fleet.estimated[self.row] = np.nan
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from ("path_loss_params", "coordinates", "reference_node", "id")
+        if not np.isnan(self.fleet.predicted[self.row, 0]):
+            yield "predicted_position"
+        if not np.isnan(self.fleet.estimated[self.row, 0]):
+            yield "estimated_path_loss_params"
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"ESPView({self.to_dict()!r})"
+
+    def to_dict(self):
+        """
+        Copie l'ESP dans un dictionnaire indépendant de la flotte.
+        """
+        esp = dict(self)
+        for key in ("path_loss_params", "estimated_path_loss_params"):
+            if key in esp:
+                esp[key] = dict(esp[key])
+        return esp
+
+
+class _ParamsView(MutableMapping):
+    """
+    Vue des caractéristiques ("path_loss_params" ou "estimated_path_loss_params") d'un ESP.
+    """
+
+    __slots__ = ("view", "keys_")
+
+    def __init__(self, view, keys):
+        self.view = view
+        self.keys_ = keys
+
+    def _column(self, key):
+        if key not in self.keys_:
+            raise KeyError(key)
+        fleet = self.view.fleet
+        if self.keys_ is ESTIMATED_KEYS:
+            return fleet.estimated[:, ESTIMATED_KEYS.index(key)]
+        return getattr(fleet, key)
+
+    def __getitem__(self, key):
+        return float(self._column(key)[self.view.row])
+
+    def __setitem__(self, key, value):
+        self._column(key)[self.view.row] = value
+
+    def __delitem__(self, key):
+        raise KeyError(f"{key!r} can't be removed from an ESP view")
+
+    def __iter__(self):
+        return iter(self.keys_)
+
+    def __len__(self):
+        return len(self.keys_)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def _colonne(values, shape, dtype):
+    """
+    `values` sous forme d'un tableau `shape` contigu, sans copie si possible,
+    ou un tableau de `nan` si `values` vaut `None`.
+    """
+    if values is None:
+        return np.full(shape, np.nan, dtype=dtype)
+    return np.ascontiguousarray(values, dtype=dtype).reshape(shape)
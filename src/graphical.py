@@ -5,93 +5,357 @@ from utils import *
 from matplotlib import pyplot as plt
 from matplotlib import animation as anm
 from matplotlib import axes
+from matplotlib import colors
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import numpy as np
+from fleet import Fleet
 import progressbar as pbar
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 
-def plot_sensors(esps, fig):
+# above this many ESPs on a plot, their labels are only drawn on demand
+SEUIL_ETIQUETTES = 200
+# colour map of the localisation error of the ESPs that have an estimated position
+CARTE_ERREURS = "plasma"
+# one curve per distance (in meters) to the ESP
+CURVES_COLORS = ("r", "b", "g", "c", "m", "y")
+CURVES_DISTANCES = tuple(2 ** i for i in range(len(CURVES_COLORS)))
+
+
+def plot_sensors(esps, fig, predictions=None, *, etiquettes=None, erreur_max=None):
     """
     Place les ESP sur le plan.
+
+    Si `predictions` (id -> position estimée) est fourni, les positions estimées en sont tirées
+    plutôt que de la clé "predicted_position" des ESPs.
+    Tout les ESPs sont dessinés par un seul nuage de points : les noeuds de référence en vert,
+    les autres à leur position estimée, colorés suivant leur erreur de localisation
+    (de 0 à `erreur_max`, par défaut la plus grande erreur), ou en bleu à leur position réelle
+    s'ils n'en ont pas.
+    Les étiquettes (id et erreur) sont dessinées si `etiquettes` est vrai ou, par défaut,
+    s'il y a au plus `SEUIL_ETIQUETTES` ESPs.
+
+    Retourne le nuage de points, utilisable pour une barre de couleurs.
     """
-    for esp in esps:
-        # les nœuds de référence sont verts, les autres sont bleus
-        color = "g" if esp["reference_node"] else "b"
-        identifier = esp["id"]
-        real_pos = esp["coordinates"]
+    (ids, coords, reference, predicted) = _colonnes(esps, predictions)
+    located = ~np.isnan(predicted[:, 0])
+    errors = np.hypot(*(predicted[located] - coords[located]).T)
+    if erreur_max is None:
+        erreur_max = errors.max() if errors.size else 1.0
+    norm = colors.Normalize(0, erreur_max)
 
-        if "predicted_position" in esp:
-            pos = esp["predicted_position"]
-            #distance to the esp's real position
-            # used to judge the precision of the estimate
-            d = distance(real_pos, pos)
-            fig.plot(*pos, color + ".")
-            fig.text(*pos, f"{identifier} ({d:.2f})")
-        else:
-            fig.plot(*real_pos, color + ".")
-            fig.text(*real_pos, identifier)
+    # les nœuds de référence sont verts, les autres sont bleus
+    points = np.where(located[:, None], predicted, coords)
+    rgba = np.empty((len(ids), 4))
+    rgba[:] = colors.to_rgba("b")
+    rgba[reference] = colors.to_rgba("g")
+    rgba[located] = plt.get_cmap(CARTE_ERREURS)(norm(errors))
 
+    collection = fig.scatter(*points.T, c=rgba, s=16, marker=".", linewidths=0)
+    # keep the scale of the errors for `colorbar`
+    collection.set_cmap(CARTE_ERREURS)
+    collection.set_norm(norm)
 
-def plot_reseau(esps, dims, title, fig):
+    if etiquettes is None:
+        etiquettes = len(ids) <= SEUIL_ETIQUETTES
+    if etiquettes:
+        #distance to the esp's real position
+        # used to judge the precision of the estimate
+        labels = np.full(len(ids), None, dtype=object)
+        labels[located] = [
+            f"{identifier} ({d:.2f})" for identifier, d in zip(ids[located], errors)
+        ]
+        labels[~located] = ids[~located]
+        for pos, label in zip(points, labels):
+            fig.text(*pos, label)
+
+    return collection
+
+
+def _colonnes(esps, predictions):
+    """
+    Les identifiants, les coordonnées, le masque des noeuds de référence et les
+    positions estimées (`nan` si absentes) des `esps`, sous forme de tableaux.
+    """
+    if isinstance(esps, Fleet):
+        ids, coords, reference = esps.ids, esps.coords, esps.reference
+        predicted = esps.predicted if predictions is None else None
+    else:
+        ids = np.array([esp["id"] for esp in esps], dtype=np.int64)
+        coords = np.array([esp["coordinates"] for esp in esps], dtype=float)
+        reference = np.array([esp["reference_node"] for esp in esps], dtype=bool)
+        if predictions is None:
+            predictions = {
+                esp["id"]: esp["predicted_position"]
+                for esp in esps
+                if "predicted_position" in esp
+            }
+        predicted = None
+    coords = coords.reshape(len(ids), 2)
+
+    if predicted is None:
+        predicted = np.full((len(ids), 2), np.nan)
+        for i, identifier in enumerate(ids.tolist()):
+            pos = predictions.get(identifier)
+            if pos is not None:
+                predicted[i] = pos
+    return (ids, coords, reference, predicted)
+
+
+def plot_reseau(esps, dims, title, fig, predictions=None, **options):
     """
     Place les ESPs successivement sur un réseaux de plans.
 
     Utile pour comparer différentes méthodes sur le même jeu.
+    `predictions` et `options` sont transmis à `plot_sensors`, dont le nuage de points est retourné.
     """
     (x0, y0, width, height) = dims
     fig.set_xlim(x0, x0 + width)
     fig.set_ylim(y0, y0 + height)
     fig.set_title(title)
-    plot_sensors(esps, fig)
+    return plot_sensors(esps, fig, predictions, **options)
+
+
+def erreur_commune(esps, tables):
+    """
+    La plus grande erreur de localisation des `esps` d'après les `tables` de positions estimées
+    (id -> position), pour partager l'échelle des couleurs entre plusieurs graphiques.
+    """
+    coords = {esp["id"]: esp["coordinates"] for esp in esps}
+    errors = [
+        distance(coords[identifier], pos)
+        for predictions in tables
+        for identifier, pos in predictions.items()
+        if pos is not None
+    ]
+    return max(errors, default=1.0)
+
+
+def figure(nrows, ncols, *, figsize=None, headless=False, layout="constrained"):
+    """
+    Crée une figure de `nrows` x `ncols` graphiques, retourne la figure et ses axes.
+
+    `layout` est le moteur de mise en page de matplotlib, appliqué à chaque affichage.
+
+    Avec `headless`, la figure n'est pas gérée par `pyplot` : aucune fenêtre n'est ouverte
+    et elle ne peut qu'être enregistrée (par le moteur Agg, sans interface graphique).
+    """
+    if not headless:
+        return plt.subplots(nrows, ncols, figsize=figsize, layout=layout)
+    fig = Figure(figsize=figsize, layout=layout)
+    FigureCanvasAgg(fig)
+    return (fig, fig.subplots(nrows, ncols))
 
 
-def animation(frame, esp, data, limit, fig):
+def animation(frame, traces, lines, limit):
     """
     Responsable de la création d'une frame
+
+    Les courbes affichent les `limit` derniers signaux de leur trace (voir `signal_traces`)
+    jusqu'à `frame`. Seules leurs données sont mises à jour, les courbes modifiées
+    sont retournées pour que seules elles soient redessinées (blitting).
+    """
+    # the view is a window into the precomputed traces, nothing is copied nor kept
+    start = max(frame + 1 - limit, 0)
+    window = traces[:, start : frame + 1]
+    xs = np.arange(window.shape[1])
+    for line, signals in zip(lines, window):
+        line.set_data(xs, signals)
+    return lines
+
+
+def _figure_video(esp, limit, headless):
     """
-    ax = fig.axes[0]
-    ax.clear()
+    Crée la figure de la vidéo et ses courbes, initialement vides.
+
+    Les courbes sont animées : elles ne font pas partie du fond de la figure.
+    """
+    # the layout is done once, not for every frame
+    fig, ax = figure(1, 1, headless=headless, layout=None)
     ax.set_xlim([0, limit])
     ax.set_ylim([-100, 0])
     ax.set_title(f"""Force du signal de l'ESP8266 n°{esp["id"]}""")
     ax.set_ylabel("dBm")
-    for (distance, c, signals) in data:
-        F = get_signal_from_esp(esp, distance)
-        signals.append(F)
-        # truncate view to the latest values
-        signals = signals[-limit:]
-        # update view buffer for the frame
-        ax.plot(signals, c + "-", label=f"distance: {distance}m")
+    lines = [
+        ax.plot([], [], c + "-", label=f"distance: {distance}m", animated=True)[0]
+        for distance, c in zip(CURVES_DISTANCES, CURVES_COLORS)
+    ]
+    ax.legend(loc="upper right")
+    fig.tight_layout()
+    return (fig, lines)
 
-    ax.legend()
 
+def _enregistrer(esp, traces, frames, fps, out_file, progress=None):
+    """
+    Enregistre dans `out_file` les images `frames` (un `range`) de la vidéo des `traces`.
 
-def create_fluctuation_video(ref_node, out_file="animation.mp4"):
+    Le fond de la figure (axes, titre, légende) n'est dessiné qu'une fois : pour chaque image
+    il est restauré et seules les courbes sont redessinées (blitting), puis l'image est
+    transmise telle quelle à ffmpeg. `progress` est appelé avec le nombre d'images faites.
     """
-    Créé une vidéo représentant l'évolution de la fluctuation du signal pour `ref_node`.
+    limit = traces.shape[1] // 2
+    fig, lines = _figure_video(esp, limit, headless=True)
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    (width, height) = canvas.get_width_height()
 
-    Après avoir créé la vidéo elle est jouée et enregistré dans `out_file`
+    command = [
+        plt.rcParams["animation.ffmpeg_path"],
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgba",
+        "-s",
+        f"{width}x{height}",
+        "-r",
+        str(fps),
+        "-i",
+        "-",
+    ]
+    if out_file.endswith(".mp4"):
+        # the most widely readable encoding
+        command += ["-vcodec", "h264", "-pix_fmt", "yuv420p"]
+    encoder = subprocess.Popen(command + [out_file], stdin=subprocess.PIPE)
+    try:
+        for done, frame in enumerate(frames, 1):
+            canvas.restore_region(background)
+            for line in animation(frame, traces, lines, limit):
+                line.axes.draw_artist(line)
+            encoder.stdin.write(canvas.buffer_rgba())
+            if progress is not None:
+                progress(done)
+    finally:
+        encoder.stdin.close()
+        encoder.wait()
+    if encoder.returncode:
+        raise subprocess.CalledProcessError(encoder.returncode, command)
+
+
+def _segment(task):
     """
-    fig, ax = plt.subplots()
+    Enregistre un segment de la vidéo, dans un processus de calcul.
+    """
+    (esp, traces, frames, fps, out_file) = task
+    _enregistrer(esp, traces, frames, fps, out_file)
+    return len(frames)
 
-    # curves settings
-    curves_colors = ["r", "b", "g", "c", "m", "y"]
-    curves_data = [(2 ** i, curves_colors[i], []) for i in range(len(curves_colors))]
 
+def create_fluctuation_video(
+    ref_node,
+    out_file="animation.mp4",
+    *,
+    duration=10.0,
+    fps=30,
+    seed=None,
+    workers=1,
+    headless=False,
+):
+    """
+    Créé une vidéo représentant l'évolution de la fluctuation du signal pour `ref_node`.
+
+    Après avoir créé la vidéo elle est jouée et enregistré dans `out_file`
+    (seulement enregistrée avec `headless`, voir `figure`). L'enregistrement nécessite ffmpeg.
+    La vidéo dure `duration` secondes à `fps` images par seconde. Tout les signaux sont tirés
+    d'un coup, par un générateur initialisé par `seed`, avant de créer les images.
+
+    Avec plusieurs `workers`, la vidéo est découpée en autant de segments, créés en parallèle
+    dans des processus de calcul puis mis bout à bout.
+    """
     # video settings
-    duration = 10.0  # in seconds
-    fps = 30
     frames_count = int(duration * fps)
+    rng = np.random.default_rng(seed)
+    traces = signal_traces(ref_node, CURVES_DISTANCES, frames_count, rng)
+    # don't send views to the worker processes
+    esp = {"id": ref_node["id"]}
+
+    pb = _progress_bar(out_file, frames_count)
+    # recoding
+    pb.start()
+    if workers == 1:
+        frames = range(frames_count)
+        _enregistrer(esp, traces, frames, fps, out_file, progress=pb.update)
+    else:
+        _segments(esp, traces, fps, out_file, workers, pb)
+    pb.finish()
+
+    if not headless:
+        limit = frames_count // 2
+        fig, lines = _figure_video(esp, limit, headless=False)
+        # kept referenced until the window is closed
+        vid = anm.FuncAnimation(
+            fig,
+            animation,
+            fargs=(traces, lines, limit),
+            init_func=lambda: lines,
+            frames=frames_count,
+            interval=1000 / fps,
+            repeat=False,
+            blit=True,
+        )
+        plt.show()
+
+
+def _segments(esp, traces, fps, out_file, workers, pb):
+    """
+    Enregistre la vidéo par segments créés en parallèle par `workers` processus,
+    puis les met bout à bout dans `out_file`.
+    """
+    frames_count = traces.shape[1]
+    (root, extension) = os.path.splitext(out_file)
+    bounds = np.linspace(0, frames_count, workers + 1).astype(int)
+    tasks = [
+        (esp, traces, range(start, stop), fps, f"{root}.{i}{extension}")
+        for i, (start, stop) in enumerate(zip(bounds, bounds[1:]))
+        if stop > start
+    ]
 
-    vid = anm.FuncAnimation(
-        fig,
-        animation,
-        fargs=(ref_node, curves_data, frames_count // 2, fig),
-        frames=frames_count,
-        interval=1000 / fps,
-        repeat=False,
-    )
+    try:
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for count in executor.map(_segment, tasks):
+                done += count
+                pb.update(done)
 
-    plt.tight_layout()
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+            listing.writelines(
+                f"file '{os.path.abspath(task[-1])}'\n" for task in tasks
+            )
+        try:
+            subprocess.run(
+                [
+                    plt.rcParams["animation.ffmpeg_path"],
+                    "-y",
+                    "-loglevel",
+                    "error",
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    listing.name,
+                    "-c",
+                    "copy",
+                    out_file,
+                ],
+                check=True,
+            )
+        finally:
+            os.remove(listing.name)
+    finally:
+        for task in tasks:
+            if os.path.exists(task[-1]):
+                os.remove(task[-1])
 
+
+def _progress_bar(out_file, maxval):
     # configure l'aspect ASCII de la barre de progression
     pbar_elts = [
         "Enregistrement du fichier {}: ".format(out_file),
@@ -111,14 +375,4 @@ def create_fluctuation_video(ref_node, out_file="animation.mp4"):
         ")",
     ]
 
-    pb = pbar.ProgressBar(widgets=pbar_elts, maxval=frames_count)
-
-    def show_progress(frame, total_frames):
-        pb.update(frame)
-
-    # recoding
-    pb.start()
-    vid.save(out_file, progress_callback=lambda *args: pb.update(args[0]), fps=fps)
-    pb.finish()
-
-    plt.show()
+    return pbar.ProgressBar(widgets=pbar_elts, maxval=maxval)
@@ -0,0 +1,135 @@
+# Précalcul des distances aux ESPs de référence sur une grille.
+# Lorsque les ESPs de référence sont fixes, les distances de chaque point de l'espace
+# à chacun d'eux peuvent être calculées une fois pour toutes. La MSE d'un ESP en tout
+# point de la grille s'obtient alors sans calculer la moindre distance.
+
+import hashlib
+from pathlib import Path
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class DistanceGrid:
+    """
+    Distances entre les centres des cellules d'une grille couvrant `dims` et les ESPs de référence.
+
+    `distances` est un tableau (M, ny, nx) : une grille de distances par ESP de référence,
+    dans l'ordre de `ref_esps`. Il peut s'agir d'un tableau projeté en mémoire (voir `build`).
+    """
+
+    def __init__(self, distances, ref_coords, dims, resolution, path=None):
+        self.distances = distances
+        self.path = path
+        self.ref_coords = np.asarray(ref_coords, dtype=float).reshape(-1, 2)
+        self.dims = tuple(dims)
+        self.resolution = resolution
+        (x0, y0, _, _) = dims
+        (_, ny, nx) = distances.shape
+        self.xs = x0 + (np.arange(nx) + 0.5) * resolution
+        self.ys = y0 + (np.arange(ny) + 0.5) * resolution
+
+    @classmethod
+    def build(cls, ref_esps, dims, resolution, *, cache_dir=None, dtype=np.float32):
+        """
+        Calcule la grille des distances aux `ref_esps` sur `dims`, avec des cellules
+        de côté `resolution`.
+
+        Si `cache_dir` est précisé, la grille y est enregistrée au format `.npy` sous un nom
+        dépendant des ESPs de référence, de `dims` et de `resolution`. Elle est alors projetée
+        en mémoire et n'est calculée que si elle n'existe pas déjà.
+        """
+        ref_coords = np.array(
+            [ref_esp["coordinates"] for ref_esp in ref_esps], dtype=float
+        ).reshape(-1, 2)
+        (x0, y0, width, height) = dims
+        shape = (
+            len(ref_coords),
+            max(int(np.ceil(height / resolution)), 1),
+            max(int(np.ceil(width / resolution)), 1),
+        )
+
+        if cache_dir is None:
+            distances = np.empty(shape, dtype=dtype)
+        else:
+            key = _key(ref_coords, dims, resolution, dtype)
+            path = Path(cache_dir) / f"grid-{key}.npy"
+            if path.exists():
+                return cls.load(path, ref_coords, dims, resolution)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            distances = open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+        grid = cls(distances, ref_coords, dims, resolution)
+        # one reference at a time to keep the memory bounded
+        for i, (x, y) in enumerate(ref_coords):
+            distances[i] = np.hypot(grid.xs[None, :] - x, grid.ys[:, None] - y)
+
+        if cache_dir is not None:
+            distances.flush()
+            del distances, grid
+            return cls.load(path, ref_coords, dims, resolution)
+        return grid
+
+    @classmethod
+    def load(cls, path, ref_coords, dims, resolution):
+        """
+        Projette en mémoire (en lecture seule) une grille enregistrée par `build`.
+        """
+        return cls(np.load(path, mmap_mode="r"), ref_coords, dims, resolution, path)
+
+    def __getstate__(self):
+        # a cached grid is reopened from its file rather than copied to other processes
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state["distances"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            self.distances = np.load(self.path, mmap_mode="r")
+
+    def best_cell(self, ref_distances):
+        """
+        Le centre de la cellule de plus faible MSE pour les distances mesurées `ref_distances`.
+
+        `ref_distances` est un tableau (M,), `nan` pour les ESPs hors de portée
+        (voir `esp8266.references_arrays`). Seule la zone compatible avec les distances
+        mesurées est lue dans la grille.
+
+        Retourne un tuple de floats, ou `None` si aucun ESP de référence n'est à portée.
+        """
+        ref_distances = np.asarray(ref_distances, dtype=float)
+        usable = np.flatnonzero(~np.isnan(ref_distances))
+        if usable.size == 0:
+            return None
+
+        # the node lies within `distance` of each reference in range
+        real = ref_distances[usable]
+        coords = self.ref_coords[usable]
+        low = (coords - real[:, None]).max(axis=0) - self.resolution
+        high = (coords + real[:, None]).min(axis=0) + self.resolution
+        cols = self._window(self.xs, low[0], high[0])
+        rows = self._window(self.ys, low[1], high[1])
+
+        score = np.zeros((rows.stop - rows.start, cols.stop - cols.start))
+        for i, dist in zip(usable, real):
+            score += (dist - self.distances[i, rows, cols]) ** 2
+        row, col = np.unravel_index(np.argmin(score), score.shape)
+        return (float(self.xs[cols][col]), float(self.ys[rows][row]))
+
+    @staticmethod
+    def _window(centres, low, high):
+        """
+        Les indices des `centres` compris entre `low` et `high`, ou tous s'il n'y en a aucun.
+        """
+        start, stop = np.searchsorted(centres, (low, high))
+        if start >= stop:
+            return slice(0, len(centres))
+        return slice(int(start), int(stop))
+
+
+def _key(ref_coords, dims, resolution, dtype):
+    digest = hashlib.sha1(ref_coords.tobytes())
+    digest.update(np.array([*dims, resolution], dtype=float).tobytes())
+    digest.update(np.dtype(dtype).str.encode())
+    return digest.hexdigest()[:16]
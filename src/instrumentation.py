@@ -0,0 +1,155 @@
+# Instrumentation optionnelle des simulations.
+# Une fois activée (`activer`), les fonctions du projet comptent les évaluations de la MSE,
+# les signaux émis par lien, les itérations et échecs des optimiseurs ou encore la profondeur
+# atteinte par les méthodes itératives, et chronomètrent chaque étape. Désactivée (par défaut),
+# elle ne coûte qu'un test de `actif` aux endroits instrumentés.
+# Les mesures peuvent être collectées depuis plusieurs threads (voir `_verrou`).
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+# checked by the instrumented code before recording anything
+actif = False
+
+
+def _nouvel_etat():
+    return {"compteurs": {}, "maximums": {}, "durees": {}, "series": {}}
+
+
+_etat = _nouvel_etat()
+
+# guards the read-modify-write updates of `_etat`, shared by the threads of the process
+_verrou = threading.Lock()
+
+
+def activer():
+    """
+    Active la collecte des mesures.
+    """
+    global actif
+    actif = True
+
+
+def desactiver():
+    """
+    Désactive la collecte des mesures, celles déjà collectées sont conservées.
+    """
+    global actif
+    actif = False
+
+
+def reinitialiser():
+    """
+    Efface toutes les mesures collectées.
+    """
+    global _etat
+    _etat = _nouvel_etat()
+
+
+def compter(nom, n=1):
+    """
+    Ajoute `n` au compteur `nom`.
+    """
+    with _verrou:
+        compteurs = _etat["compteurs"]
+        compteurs[nom] = compteurs.get(nom, 0) + n
+
+
+def maximum(nom, valeur):
+    """
+    Retient la plus grande des valeurs données pour `nom` (une profondeur par exemple).
+    """
+    with _verrou:
+        maximums = _etat["maximums"]
+        if valeur > maximums.get(nom, valeur - 1):
+            maximums[nom] = valeur
+
+
+def enregistrer(serie, cle, valeur):
+    """
+    Associe `valeur` à `cle` dans la série `serie` (le nombre de signaux d'un lien par exemple).
+    """
+    with _verrou:
+        _etat["series"].setdefault(serie, {})[cle] = valeur
+
+
+@contextmanager
+def chronometre(nom):
+    """
+    Chronomètre le bloc `with` et ajoute sa durée à l'étape `nom`.
+    """
+    if not actif:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _verrou:
+            duree = _etat["durees"].setdefault(nom, {"total": 0.0, "appels": 0})
+            duree["total"] += elapsed
+            duree["appels"] += 1
+
+
+def snapshot():
+    """
+    Une copie des mesures collectées, sous forme d'un dictionnaire sérialisable (en JSON) :
+    - "compteurs" : nom -> total
+    - "maximums" : nom -> plus grande valeur
+    - "durees" : étape -> {"total": secondes, "appels": nombre de passages}
+    - "series" : série -> {clé (convertie en str) -> valeur}
+    """
+    with _verrou:
+        return {
+            "compteurs": dict(_etat["compteurs"]),
+            "maximums": dict(_etat["maximums"]),
+            "durees": {nom: dict(duree) for nom, duree in _etat["durees"].items()},
+            "series": {
+                serie: {str(cle): valeur for cle, valeur in valeurs.items()}
+                for serie, valeurs in _etat["series"].items()
+            },
+        }
+
+
+def fusionner(autre):
+    """
+    Ajoute les mesures `autre` (obtenues avec `snapshot`) aux mesures collectées.
+
+    Permet de rassembler les mesures collectées par d'autres processus.
+    """
+    for nom, n in autre["compteurs"].items():
+        compter(nom, n)
+    for nom, valeur in autre["maximums"].items():
+        maximum(nom, valeur)
+    with _verrou:
+        for nom, duree in autre["durees"].items():
+            total = _etat["durees"].setdefault(nom, {"total": 0.0, "appels": 0})
+            total["total"] += duree["total"]
+            total["appels"] += duree["appels"]
+        for serie, valeurs in autre["series"].items():
+            _etat["series"].setdefault(serie, {}).update(valeurs)
+
+
+@contextmanager
+def isoler(active):
+    """
+    Collecte les mesures du bloc `with` à part, `active` indiquant si la collecte est active.
+
+    Le gestionnaire donne un dictionnaire qui reçoit, à la sortie du bloc, le `snapshot`
+    des mesures du bloc. L'état précédent est ensuite restauré. Utile dans les processus
+    de calcul, dont les mesures sont renvoyées au processus principal pour y être fusionnées.
+    Ne doit pas être utilisé depuis plusieurs threads à la fois.
+    """
+    global _etat, actif
+    previous = (_etat, actif)
+    _etat, actif = _nouvel_etat(), active
+    capture = {}
+    try:
+        yield capture
+    finally:
+        capture.update(snapshot())
+        _etat, actif = previous
@@ -1,15 +1,11 @@
 #!/usr/bin/python3.9
-from math import log10
+# Point d'entrée de la simulation, en ligne de commande (voir `main`).
+# Les modules lourds à importer (matplotlib, scipy) ne le sont que par
+# les commandes qui en ont besoin.
+
+import argparse
 import random
-from matplotlib import pyplot as plt
-from esp8266 import *
-from methods import (
-    methode_partition,
-    methode_MonteCarlo,
-    methode_gradient,
-    apply_method,
-)
-from graphical import plot_reseau, create_fluctuation_video
+import sys
 
 
 def plot_power(signals, real_mean, real_sigma):
@@ -17,6 +13,9 @@ def plot_power(signals, real_mean, real_sigma):
     Permet de visualiser la distribution des `signals`
     """
 
+    from matplotlib import pyplot as plt
+    from utils import frequencies
+
     # just to get a quick view into the shape of the distribution
     # does not act as a proof
     freq = frequencies(signals, margin=0.01)
@@ -24,10 +23,13 @@ def plot_power(signals, real_mean, real_sigma):
     plt.show()
 
 
-def main():
+def etude():
     """
     Effectue successivement les différentes visualisations requises pour l'étude.
     """
+    from utils import read_csv
+    from esp8266 import signal_moyen
+
     print("Running ESP8266 positionning simulation")
     # plot_power(get_measures(4096, -55, 1.6))
     # print(read_csv("config-reseau.csv"))
@@ -47,6 +49,8 @@ def random_set():
     """
     Génère un jeu d'ESPs dans un espace aléatoire.
     """
+    from esp8266 import new_esp
+
     ref_node_count = random.randrange(3, 20)
     node_count = ref_node_count + random.randrange(1, 10)
     width = random.randrange(10, 50)
@@ -62,14 +66,41 @@ def random_set():
     return (esps, dims)
 
 
-def methods_comparison(dims, source_file=None, esps=[]):
+def methods_comparison(
+    dims,
+    source_file=None,
+    esps=[],
+    *,
+    workers=None,
+    out_file="localisation.png",
+    headless=False,
+    etiquettes=None,
+    seed=None,
+    cache=None,
+):
     """
-    Applique et visualise successivement toutes les méthodes de géolocalisation.
+    Applique toutes les méthodes de géolocalisation puis les visualise.
 
     Nécessite un jeu d'esps qui peut venir d'un fichier source (`source_file`),
     d'une liste d'`esps` ou d'une combinaison des deux. `dims` est la description de l'espace
     dans lequel la simulation se produit. Pour en savoir plus sur `dims` voir `utils.into_corners`
+
+    Les méthodes sont appliquées simultanément par `workers` processus (voir `methods.comparer_methodes`).
+    Retourne les positions estimées par chaque méthode (nom -> id -> position).
+
+    La figure est enregistrée dans `out_file` puis affichée, sauf avec `headless` où elle est
+    seulement enregistrée, sans ouvrir de fenêtre (voir `graphical.figure`).
+    `etiquettes` est transmis à `graphical.plot_sensors`.
+
+    Le calibrage utilise la graine `seed`. Si un `cache.CacheReseau` est fourni, le calibrage
+    et les distances d'un réseau déjà étudié (avec la même `seed`) n'y sont pas recalculés.
     """
+    from matplotlib import pyplot as plt
+    from esp8266 import calibrage_references, distances_reseau, reference_nodes
+    from graphical import erreur_commune, figure, plot_reseau
+    from methods import METHODES, comparer_methodes
+    from utils import read_csv
+    import instrumentation
 
     if source_file is not None:
         try:
@@ -78,51 +109,307 @@ def methods_comparison(dims, source_file=None, esps=[]):
             pass
 
     ref_esps = reference_nodes(esps)
-    calibrage_references(ref_esps)
+    if cache is None:
+        calibrage_references(ref_esps, seed=seed)
+    else:
+        cache.calibrage(ref_esps, seed=seed)
+
+    with instrumentation.chronometre("distances"):
+        if cache is not None:
+            distances = cache.distances(esps, ref_esps)
+        else:
+            distances = distances_reseau(esps, ref_esps)
 
-    distances = {}
-    for esp in esps:
-        if not esp["reference_node"]:
-            distances[esp["id"]] = distances_aux_references(esp, ref_esps)
+    # each method runs in its own process and its predictions are kept apart
+    results = comparer_methodes(esps, ref_esps, distances, dims, workers=workers)
 
-    fig, axs = plt.subplots(3, 4, figsize=(12, 8))
+    # the network twice, then one plot per method
+    rows = -(-(2 + len(results)) // 4)
+    fig, axs = figure(rows, 4, figsize=(12, 2.7 * rows), headless=headless)
+    for ax in axs.flat[2 + len(results) :]:
+        ax.axis("off")
 
     # graphiques de références, sans application de méthode de détetection
-    plot_reseau(ref_esps, dims, "Capteurs de référence", axs[0][0])
-    plot_reseau(ref_esps, dims, "Réseau de noeuds", axs[0][1])
-
-    # méthode de partition
-    apply_method(esps, ref_esps, distances, dims, methode_partition)
-    plot_reseau(esps, dims, "Méthode par partition", axs[0][2])
-
-    # méthode de Monte-Carlo
-    apply_method(esps, ref_esps, distances, dims, methode_MonteCarlo)
-    plot_reseau(esps, dims, "Méthode de Monté-Carlo", axs[0][3])
-
-    # méthodes de gradient utilisant les divers méthode de calcul de gradient
-    (i, j) = (1, 0)
-
-    for method in (
-        "Nelder-Mead",
-        "Powell",
-        "CG",
-        "BFGS",
-        "L-BFGS-B",
-        "TNC",
-        "COBYLA",
-        "SLSQP",
-    ):
-        apply_method(esps, ref_esps, distances, dims, methode_gradient, methode=method)
-        plot_reseau(esps, dims, f"Méthode du gradient ({method})", axs[i, j])
-        j += 1
-        if j == 4:
-            j = 0
-            i += 1
-
-    plt.tight_layout()
-    plt.savefig("localisation.png")
-    plt.show()
+    options = {"etiquettes": etiquettes}
+    plot_reseau(ref_esps, dims, "Capteurs de référence", axs[0][0], **options)
+    plot_reseau(ref_esps, dims, "Réseau de noeuds", axs[0][1], **options)
+
+    # un graphique par méthode, dans l'ordre de `methods.METHODES`
+    # all of them share the same error colour scale
+    options["erreur_max"] = erreur_commune(esps, results.values())
+    titles = {name: title for name, title, _, _ in METHODES}
+    for ax, (name, predictions) in zip(axs.flat[2:], results.items()):
+        collection = plot_reseau(esps, dims, titles[name], ax, predictions, **options)
+    fig.colorbar(collection, ax=axs, shrink=0.6, label="Erreur (m)")
+
+    fig.savefig(out_file)
+    if not headless:
+        plt.show()
+
+    return results
+
+
+def generer(args):
+    from scenarios import ecrire_reseau
+
+    ecrire_reseau(
+        args.sortie,
+        args.references,
+        args.noeuds,
+        tuple(args.dims),
+        seed=args.seed,
+        disposition=args.disposition,
+    )
+
+
+def calibrer(args):
+    from esp8266 import calibrage_references
+    from fleet import ESTIMATED_KEYS, Fleet
+
+    fleet = Fleet.from_csv(args.reseau)
+    if args.pilote is None:
+        calibrage_references(fleet, seed=args.seed, workers=args.workers)
+    else:
+        _calibrer_avec_pilote(fleet, args)
+    references = fleet.reference
+    _ecrire_colonnes(
+        args.sortie,
+        ("id", *ESTIMATED_KEYS),
+        fleet.ids[references],
+        *fleet.estimated[references].T,
+    )
+
+
+def _calibrer_avec_pilote(fleet, args):
+    """
+    Calibre `fleet` en demandant les signaux à un serveur TCP, `args.pilote` étant
+    son adresse (hôte:port) ou "simule" pour un `pilotes.ServeurSimule` local.
+    Le débit obtenu est affiché sur la sortie d'erreur.
+    """
+    import time
+    from contextlib import nullcontext
+    from esp8266 import calibrage_references
+    from pilotes import PiloteTCP, serveur_simule
+
+    if args.pilote == "simule":
+        server = serveur_simule(fleet.to_esps(), seed=args.seed)
+    else:
+        (host, port) = args.pilote.rsplit(":", 1)
+        server = nullcontext(argparse.Namespace(host=host, port=int(port)))
+
+    metrics = {}
+    with server as address:
+        pilote = PiloteTCP(address.host, address.port, connexions=args.connexions)
+        start = time.perf_counter()
+        calibrage_references(fleet, pilote=pilote, metrics=metrics)
+        elapsed = time.perf_counter() - start
+    count = sum(metrics.values())
+    print(
+        f"{count} signals from {len(metrics)} links in {elapsed:.3f}s "
+        f"({count / elapsed:.0f} signals/s)",
+        file=sys.stderr,
+    )
+
+
+def localiser(args):
+    from methods import METHODES
+    from esp8266 import calibrage_references, distances_reseau
+    from fleet import Fleet
+    from methods import apply_method_parallel
+
+    methodes = {name: (methode, kwargs) for name, _, methode, kwargs in METHODES}
+    if args.methode not in methodes:
+        sys.exit(f"Unknown method {args.methode!r}, known: {', '.join(methodes)}")
+    (methode, kwargs) = methodes[args.methode]
+
+    fleet = Fleet.from_csv(args.reseau)
+    dims = _dims(args, fleet.coords)
+    cache = _cache(args)
+    ref_esps = fleet.references()
+    if cache is None:
+        calibrage_references(fleet, seed=args.seed, workers=args.workers)
+        distances = distances_reseau(fleet, ref_esps)
+    else:
+        cache.calibrage(fleet, seed=args.seed, workers=args.workers)
+        distances = cache.distances(fleet, ref_esps)
+    hors_de_portee = apply_method_parallel(
+        fleet, ref_esps, distances, dims, methode, workers=args.workers, **kwargs
+    )
+    if hors_de_portee:
+        print(
+            f"{len(hors_de_portee)} nodes weren't located, no reference is in range",
+            file=sys.stderr,
+        )
+    targets = ~fleet.reference
+    _ecrire_colonnes(
+        args.sortie, ("id", "x", "y"), fleet.ids[targets], *fleet.predicted[targets].T
+    )
+
+
+def comparer(args):
+    if args.reseau is None:
+        (esps, dims) = random_set()
+    else:
+        from utils import read_csv
+
+        esps = read_csv(args.reseau)
+        dims = _dims(args, [esp["coordinates"] for esp in esps])
+    methods_comparison(
+        dims,
+        esps=esps,
+        workers=args.workers,
+        out_file=args.sortie,
+        headless=args.headless,
+        seed=args.seed,
+        cache=_cache(args),
+    )
+
+
+def video(args):
+    from esp8266 import reference_nodes
+    from graphical import create_fluctuation_video
+    from scenarios import generer_reseau
+    from utils import read_csv
+
+    if args.reseau is None:
+        # drawn like `esp8266.new_esp`, but from `--seed`
+        ref_node = generer_reseau(1, 0, (0, 0, 5, 5), seed=args.seed).to_esps()[0]
+    else:
+        ref_node = reference_nodes(read_csv(args.reseau))[0]
+    create_fluctuation_video(
+        ref_node,
+        args.sortie,
+        duration=args.duree,
+        fps=args.fps,
+        seed=args.seed,
+        workers=args.workers,
+        headless=args.headless,
+    )
+
+
+def _cache(args):
+    """
+    Le cache des résultats du réseau, si un répertoire `--cache` est donné.
+    """
+    if args.cache is None:
+        return None
+    from cache import CacheReseau
+
+    return CacheReseau(args.cache)
+
+
+def _dims(args, coords):
+    """
+    L'espace de la simulation : celui donné en argument ou, par défaut, le plus petit
+    rectangle contenant tout les ESPs de `coords`.
+    """
+    if args.dims is not None:
+        return tuple(args.dims)
+    (xs, ys) = zip(*coords)
+    return (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+
+def _ecrire_colonnes(out_file, header, *columns):
+    """
+    Écrit les `columns` dans `out_file` (`-` pour la sortie standard), séparées par
+    des tabulations comme dans les fichiers lus par `utils.read_csv`.
+    """
+    file = sys.stdout if out_file == "-" else open(out_file, "w")
+    try:
+        file.write("#" + "\t".join(header) + "\n")
+        file.writelines(
+            "\t".join(map(str, row)) + "\n"
+            for row in zip(*(column.tolist() for column in columns))
+        )
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+def main(argv=None):
+    """
+    Analyse les arguments de la ligne de commande et exécute la commande choisie.
+
+    Sans commande, l'étude est effectuée (voir `etude`).
+    """
+    parser = argparse.ArgumentParser(description="ESP8266 positionning simulation")
+    commands = parser.add_subparsers(dest="command")
+
+    dims = dict(type=float, nargs=4, metavar=("X0", "Y0", "WIDTH", "HEIGHT"))
+    command = commands.add_parser("generate", help="generate a network into a CSV file")
+    command.add_argument("sortie", help="CSV file to write")
+    command.add_argument("--references", type=int, default=100)
+    command.add_argument("--noeuds", type=int, default=1000)
+    command.add_argument("--dims", default=(0.0, 0.0, 100.0, 100.0), **dims)
+    command.add_argument("--disposition", default="uniforme")
+    command.add_argument("--seed", type=int)
+    command.set_defaults(run=generer)
+
+    command = commands.add_parser(
+        "calibrate", help="estimate the path loss parameters of the reference nodes"
+    )
+    command.add_argument("reseau", help="CSV file of the network")
+    command.add_argument("--sortie", default="-", help="output file, - for stdout")
+    command.add_argument("--seed", type=int)
+    command.add_argument("--workers", type=int)
+    command.add_argument(
+        "--pilote",
+        metavar="HOST:PORT",
+        help="ask the signals to this server, 'simule' for a local simulated one",
+    )
+    command.add_argument("--connexions", type=int, default=16)
+    command.set_defaults(run=calibrer)
+
+    command = commands.add_parser("localize", help="locate the nodes of a network")
+    command.add_argument("reseau", help="CSV file of the network")
+    command.add_argument(
+        "--methode", default="gradient (L-BFGS-B)", help="method name, see methods.METHODES"
+    )
+    command.add_argument("--sortie", default="-", help="output file, - for stdout")
+    command.add_argument("--dims", **dims)
+    command.add_argument("--seed", type=int)
+    command.add_argument("--workers", type=int)
+    command.add_argument("--cache", help="directory of the calibration/distances cache")
+    command.set_defaults(run=localiser)
+
+    command = commands.add_parser("compare", help="compare the methods on a network")
+    command.add_argument("reseau", nargs="?", help="CSV file, random network if absent")
+    command.add_argument("--sortie", default="localisation.png")
+    command.add_argument("--dims", **dims)
+    command.add_argument("--workers", type=int)
+    command.add_argument("--headless", action="store_true", help="don't open a window")
+    command.add_argument("--seed", type=int)
+    command.add_argument("--cache", help="directory of the calibration/distances cache")
+    command.set_defaults(run=comparer)
+
+    command = commands.add_parser("video", help="record the signal fluctuation video")
+    command.add_argument("reseau", nargs="?", help="CSV file, a random node if absent")
+    command.add_argument("--sortie", default="animation.mp4")
+    command.add_argument("--duree", type=float, default=10.0, help="in seconds")
+    command.add_argument("--fps", type=int, default=30)
+    command.add_argument("--seed", type=int)
+    command.add_argument("--workers", type=int, default=1)
+    command.add_argument("--headless", action="store_true", help="don't open a window")
+    command.set_defaults(run=video)
+
+    # its arguments are parsed by `bench.main`
+    command = commands.add_parser(
+        "bench", help="benchmark the methods (see bench.py --help)", add_help=False
+    )
+
+    (args, extra) = parser.parse_known_args(argv)
+    if args.command == "bench":
+        import bench
+
+        return bench.main(extra)
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if args.command is None:
+        etude()
+    else:
+        args.run(args)
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
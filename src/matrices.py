@@ -0,0 +1,164 @@
+# Calcul vectorisé des grandeurs entre deux ensembles d'ESPs.
+# Plutôt qu'une distance ou une puissance par appel (voir `utils.distance`,
+# `esp8266.mean_power` et `utils.get_signal_from_esp`), les distances, puissances moyennes
+# et puissances mesurées (RSSI) entre N ESPs et M ESPs de référence sont calculées
+# d'un seul passage sur des tableaux (N, M) : une ligne par ESP, une colonne par ESP
+# de référence, qui est l'émetteur. Les grands ensembles sont traités par blocs de lignes,
+# ce qui borne la mémoire des calculs intermédiaires.
+
+import numpy as np
+from fleet import ESTIMATED_KEYS, PATH_LOSS_KEYS, Fleet
+
+
+# memory allowed for the intermediate arrays of a block, in bytes
+MEMOIRE_BLOC = 32 << 20
+
+
+def coordonnees(esps):
+    """
+    Les coordonnées de `esps` (une liste d'ESPs ou une `fleet.Fleet`), un tableau (N, 2).
+    """
+    if isinstance(esps, Fleet):
+        return esps.coords
+    return np.array([esp["coordinates"] for esp in esps], dtype=float).reshape(-1, 2)
+
+
+def noeuds(esps):
+    """
+    Les ids (une liste) et les coordonnées (un tableau (N, 2)) des ESPs de `esps`
+    qui ne sont pas de référence, dans l'ordre de `esps`.
+    """
+    if isinstance(esps, Fleet):
+        targets = ~esps.reference
+        return esps.ids[targets].tolist(), esps.coords[targets]
+    targets = [esp for esp in esps if not esp["reference_node"]]
+    return [esp["id"] for esp in targets], coordonnees(targets)
+
+
+def caracteristiques(esps, cle="path_loss_params"):
+    """
+    Les caractéristiques `cle` ("path_loss_params" ou "estimated_path_loss_params")
+    de `esps` (une liste d'ESPs ou une `fleet.Fleet`).
+
+    Retourne un dictionnaire associant à chaque caractéristique un tableau (N,).
+    """
+    keys = ESTIMATED_KEYS if cle == "estimated_path_loss_params" else PATH_LOSS_KEYS
+    if isinstance(esps, Fleet):
+        if keys is ESTIMATED_KEYS:
+            return {key: esps.estimated[:, i] for i, key in enumerate(keys)}
+        return {key: getattr(esps, key) for key in keys}
+    return {
+        key: np.array([esp[cle][key] for esp in esps], dtype=float) for key in keys
+    }
+
+
+def blocs(lignes, colonnes, *, memoire=MEMOIRE_BLOC, temporaires=4):
+    """
+    Découpe `lignes` lignes en tranches successives, de sorte que `temporaires` tableaux
+    (nombre de lignes de la tranche, `colonnes`) de float64 tiennent dans `memoire` octets.
+
+    Une tranche contient toujours au moins une ligne.
+    """
+    step = max(1, memoire // (8 * temporaires * max(colonnes, 1)))
+    for start in range(0, lignes, step):
+        yield slice(start, min(start + step, lignes))
+
+
+def distances(a, b):
+    """
+    Les distances euclidiennes entre les positions de `a` et de `b`, élément par élément.
+
+    `a` et `b` sont des tableaux (..., 2) compatibles pour le broadcasting numpy.
+    Le calcul est celui de `utils.distance`.
+    """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    dx = b[..., 0] - a[..., 0]
+    dy = b[..., 1] - a[..., 1]
+    return np.sqrt(dy * dy + dx * dx)
+
+
+def puissances_moyennes(distances, params):
+    """
+    Les puissances moyennes théoriques (voir `esp8266.mean_power`) à `distances`.
+
+    Les tableaux de `params` (voir `caracteristiques`) sont ceux des émetteurs,
+    qui correspondent au dernier axe de `distances`. Les distances nulles donnent
+    une puissance infinie.
+    """
+    d = np.asarray(distances, dtype=float)
+    with np.errstate(divide="ignore"):
+        return params["P0"] - 10 * params["gamma"] * np.log10(d / params["d0"])
+
+
+def rssi(moyennes, sigma, rng):
+    """
+    Des puissances mesurées (RSSI), simulées comme par `utils.get_signal_from_esp`
+    autour des puissances moyennes `moyennes` avec l'écart-type `sigma` des émetteurs.
+
+    Les tirages sont effectués par le générateur numpy `rng`.
+    """
+    moyennes = np.asarray(moyennes, dtype=float)
+    return moyennes + sigma * rng.standard_normal(moyennes.shape)
+
+
+def distances_rssi(puissances, params):
+    """
+    Inverse de `puissances_moyennes` : les distances correspondant aux `puissances` (dBm)
+    suivant les caractéristiques `params` des émetteurs (en général estimées, voir
+    `esp8266.calibrage_references`), qui correspondent au dernier axe de `puissances`.
+    """
+    p = np.asarray(puissances, dtype=float)
+    return params["d0"] * 10 ** ((params["P0"] - p) / (10 * params["gamma"]))
+
+
+def matrice_distances(
+    coords, ref_coords, *, portee=None, out=None, memoire=MEMOIRE_BLOC
+):
+    """
+    Le tableau (N, M) des distances entre les positions `coords` (N, 2)
+    et `ref_coords` (M, 2) (voir `coordonnees`).
+
+    Les distances supérieures à `portee` (si elle est précisée) valent `nan`.
+    Le résultat est écrit dans `out` s'il est fourni (un `np.memmap` par exemple).
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    ref_coords = np.asarray(ref_coords, dtype=float).reshape(-1, 2)
+
+    def calcul(rows):
+        d = distances(coords[rows, None, :], ref_coords[None, :, :])
+        if portee is not None:
+            d[d > portee] = np.nan
+        return d
+
+    return _par_blocs(calcul, len(coords), len(ref_coords), out, memoire)
+
+
+def matrice_puissances(
+    coords, ref_coords, params, *, portee=None, out=None, memoire=MEMOIRE_BLOC
+):
+    """
+    Le tableau (N, M) des puissances moyennes reçues en `coords` (N, 2) et émises par
+    les ESPs en `ref_coords` (M, 2), de caractéristiques `params` (voir `caracteristiques`).
+
+    Les puissances au delà de `portee` valent `nan`, `out` est celui de `matrice_distances`.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+
+    def calcul(rows):
+        d = matrice_distances(coords[rows], ref_coords, portee=portee, memoire=memoire)
+        return puissances_moyennes(d, params)
+
+    return _par_blocs(calcul, len(coords), len(ref_coords), out, memoire)
+
+
+def _par_blocs(calcul, lignes, colonnes, out, memoire):
+    """
+    Remplit `out` (alloué s'il n'est pas fourni), un tableau (`lignes`, `colonnes`),
+    tranche par tranche (voir `blocs`) avec `calcul(tranche)`.
+    """
+    if out is None:
+        out = np.empty((lignes, colonnes))
+    for rows in blocs(lignes, colonnes, memoire=memoire):
+        out[rows] = calcul(rows)
+    return out
@@ -2,112 +2,459 @@
 # L'explicaton de leur fonctionnement peut être trouvé dans le rapport.
 
 from utils import *
-from esp8266 import MSE
-import random
+from esp8266 import (
+    MSE_batch,
+    MSE_gradient,
+    references_arrays,
+    residuals,
+    residuals_jacobian,
+    usable_references,
+)
+import numbers
+import sys
+import numpy as np
+import instrumentation
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from scipy import optimize as opti
+from grid import DistanceGrid
 
 
-def methode_partition(esp, ref_esps, distances, dims, *, epsilon=0.01):
+class HorsDePortee(ValueError):
     """
-    détermination de la position par méthode des partitions (ici itération d'une grille 2x2)
+    Aucun ESP de référence n'est à portée de l'ESP à localiser : la méthode ne peut
+    estimer sa position.
     """
-    if dims[2] * dims[3] < epsilon:
-        esp["predicted_position"] = middle_rect(dims)
 
-    else:
-        corners = into_corners(dims)
 
-        min_mse = None
-        matching_corner = None
-        for corner, i in zip(corners, range(4)):
-            mse = MSE((pos := (corner[0], corner[1])), ref_esps, distances)
-            if (min_mse is None) or (min_mse > mse):
-                min_mse = mse
-                matching_corner = i
+def methode_partition(
+    esp,
+    ref_esps,
+    distances,
+    dims,
+    *,
+    epsilon=0.01,
+    subdivisions=2,
+    faisceau=1,
+    tolerance=0.0,
+):
+    """
+    détermination de la position par méthode des partitions (itération d'une grille `subdivisions` x `subdivisions`)
 
-        if min_mse == -1:
-            raise ValueError(
+    À chaque niveau les `faisceau` meilleures cellules du niveau précédent sont divisées
+    et toutes les nouvelles cellules sont notées en leur centre d'un seul bloc.
+    La méthode s'arrête lorsque l'aire des cellules devient inférieure à `epsilon`
+    ou que le meilleur score est inférieur à `tolerance`.
+    """
+    ref_coords, ref_distances = references_arrays(ref_esps, distances)
+    esp["predicted_position"] = _partition(
+        ref_coords,
+        ref_distances,
+        dims,
+        epsilon=epsilon,
+        subdivisions=subdivisions,
+        faisceau=faisceau,
+        tolerance=tolerance,
+    )
+
+
+def _partition(
+    ref_coords,
+    ref_distances,
+    dims,
+    *,
+    epsilon=0.01,
+    subdivisions=2,
+    faisceau=1,
+    tolerance=0.0,
+    niveaux=None,
+):
+    """
+    Le coeur itératif de `methode_partition`, limité à `niveaux` niveaux si précisé.
+
+    Retourne le milieu de la meilleure cellule.
+    """
+    cells = np.array([dims], dtype=float)
+    level = 0
+    # all the cells of a level have the same area
+    while cells[0, 2] * cells[0, 3] >= epsilon and (niveaux is None or level < niveaux):
+        cells = subdivide(cells, subdivisions)
+        centres = cells[:, :2] + cells[:, 2:] / 2
+        scores = MSE_batch(centres, ref_coords, ref_distances)
+
+        if scores[0] == -1:
+            raise HorsDePortee(
                 "All reference esps were too far from `esp`, hence the method couldn't be applied"
             )
-        if min_mse == 0:
-            esp["predicted_position"] = pos
-        else:
-            methode_partition(
-                esp, ref_esps, distances, corners[matching_corner], epsilon=epsilon
-            )
+        best = np.argsort(scores, kind="stable")[:faisceau]
+        cells = cells[best]
+        level += 1
+        if instrumentation.actif:
+            instrumentation.maximum("profondeur_partition", level)
+        if scores[best[0]] <= tolerance:
+            break
+
+    return middle_rect(cells[0])
 
 
 def methode_MonteCarlo(
-    esp, ref_esps, distances, dims, *, epsilon=0.01, nb_tirages=None
+    esp,
+    ref_esps,
+    distances,
+    dims,
+    *,
+    epsilon=0.01,
+    nb_tirages=None,
+    sequence="uniforme",
+    precision=None,
+    retrecissement=0.5,
+    min_tirages=16,
+    max_tirages=4096,
+    seed=None,
 ):
     """
     détermination de la position par méthode de Monte-Carlo
+
+    À chaque niveau un lot de points est tiré dans `dims` et noté d'un seul bloc, puis
+    l'espace est réduit autour du meilleur point. Le nombre de points par niveau vaut:
+    - `nb_tirages` s'il est précisé
+    - sinon, si `precision` est précisée, le nombre nécessaire pour espacer les points d'environ
+    `precision` (borné par `min_tirages` et `max_tirages`)
+    - sinon la plus grande dimension de l'espace (plus un)
+
+    `sequence` vaut "uniforme" (tirages pseudo-aléatoires), "sobol" ou "halton" (suites à
+    discrépance faible, qui couvrent l'espace plus régulièrement).
+    `retrecissement` est le facteur de réduction de l'espace à chaque niveau (strictement
+    compris entre 0 et 1), ou "adaptatif" pour le déduire de la dispersion des meilleurs points.
+    `seed` rend les tirages reproductibles.
     """
-    (x0, y0, width, height) = dims
+    if retrecissement != "adaptatif" and not (
+        isinstance(retrecissement, numbers.Real) and 0 < retrecissement < 1
+    ):
+        raise ValueError(
+            f"retrecissement must be 'adaptatif' or in ]0, 1[, got {retrecissement!r}"
+        )
+    ref_coords, ref_distances = references_arrays(ref_esps, distances)
+    draw = _tirages(sequence, np.random.default_rng(seed))
 
-    if width * height < epsilon:
-        esp["predicted_position"] = middle_rect(dims)
-        return None
+    (x0, y0, width, height) = dims
+    level = 0
+    while width * height >= epsilon:
+        level += 1
+        if instrumentation.actif:
+            instrumentation.maximum("profondeur_MonteCarlo", level)
+        if nb_tirages is not None:
+            points_nbr = nb_tirages
+        elif precision is not None:
+            points_nbr = int(np.ceil(width * height / precision ** 2))
+            points_nbr = min(max(points_nbr, min_tirages), max_tirages)
+        else:
+            points_nbr = int(max(width, height)) + 1
 
-    if nb_tirages is None:
-        points_nbr = int(max(width, height)) + 1
+        assert (
+            points_nbr > 0
+        ), f"Width and height must be greater than 0, got {width}, {height}"
 
-    assert (
-        points_nbr > 0
-    ), f"Width and height must be greater than 0, got {width}, {height}"
+        # all the points of this level are drawn and scored at once
+        points = np.array([x0, y0]) + draw(points_nbr) * np.array([width, height])
+        scores = MSE_batch(points, ref_coords, ref_distances)
+        best = int(np.argmin(scores))
+        min_mse = scores[best]
+        matching_pos = (points[best, 0], points[best, 1])
 
-    min_mse = None
-    matching_pos = None
-    for _ in range(points_nbr):
-        pos = random_uniform_pos(dims)
-        mse = MSE(pos, ref_esps, distances)
-        if (min_mse is None) or (min_mse > mse):
-            min_mse = mse
-            matching_pos = pos
+        if min_mse == -1:
+            raise HorsDePortee(
+                "All reference esps were too far from `esp`, hence the method couldn't be applied"
+            )
+        if min_mse == 0:
+            esp["predicted_position"] = matching_pos
+            return None
 
-    if min_mse == -1:
-        raise ValueError(
-            "All reference esps were too far from `esp`, hence the method couldn't be applied"
-        )
-    if min_mse == 0:
-        esp["predicted_position"] = min_pos
-    else:
-        methode_MonteCarlo(
-            esp,
-            ref_esps,
-            distances,
-            # on créé un rectangle autour du point avec la meilleure MSE
-            (
-                matching_pos[0] - width / 4,
-                matching_pos[1] - height / 4,
-                width / 2,
-                height / 2,
-            ),
-            epsilon=epsilon,
-            nb_tirages=nb_tirages,
+        if retrecissement == "adaptatif":
+            factor = _retrecissement_adaptatif(points, scores, width, height)
+        else:
+            factor = retrecissement
+        # on créé un rectangle autour du point avec la meilleure MSE
+        (x0, y0, width, height) = (
+            matching_pos[0] - width * factor / 2,
+            matching_pos[1] - height * factor / 2,
+            width * factor,
+            height * factor,
         )
 
+    esp["predicted_position"] = middle_rect((x0, y0, width, height))
+
+
+def _tirages(sequence, rng):
+    """
+    Retourne une fonction tirant `n` points de [0, 1[² suivant `sequence`.
+    """
+    if sequence == "uniforme":
+        return lambda n: rng.random((n, 2))
+    if sequence in ("sobol", "halton"):
+        from scipy.stats import qmc
+
+        if sequence == "sobol":
+            engine = qmc.Sobol(2, seed=rng)
+
+            def draw(n):
+                # Sobol points are only balanced by powers of two from the start of
+                # the sequence, so each level restarts it with a random shift and
+                # keeps the first `n` points of the next power of two
+                engine.reset()
+                points = engine.random_base2(max(int(np.ceil(np.log2(n))), 0))[:n]
+                return (points + rng.random(2)) % 1
+
+            return draw
+        return qmc.Halton(2, seed=rng).random
+    raise ValueError(f"Unknown sequence {sequence!r}")
+
+
+def _retrecissement_adaptatif(
+    points, scores, width, height, *, minimum=0.1, maximum=0.75
+):
+    """
+    Le facteur de réduction de l'espace déduit de la dispersion des meilleurs points.
+
+    Si les meilleurs 10% des points sont regroupés, l'espace est fortement réduit.
+    S'ils sont épars, plusieurs minima sont plausibles et l'espace l'est peu.
+    """
+    elite = points[np.argsort(scores)[: max(len(points) // 10, 2)]]
+    spread = np.ptp(elite, axis=0) / np.array([width, height])
+    # twice the spread so that the whole elite stays inside the new space
+    return float(np.clip(2 * spread.max(), minimum, maximum))
+
+
+# `scipy.optimize.minimize` methods making use of the gradient
+GRADIENT_METHODS = ("CG", "BFGS", "L-BFGS-B", "TNC", "SLSQP")
+
+# cells along the largest side of the grids of `methode_grille`
+CELLULES_GRILLE = 128
+
+# distance under which a reference is considered to be on the ESP
+DISTANCE_MIN = 1e-3
+
 
 def methode_gradient(
-    esp, ref_esps, distances, dims, *, epsilon=0.01, methode="L-BFGS-B"
+    esp,
+    ref_esps,
+    distances,
+    dims,
+    *,
+    epsilon=0.01,
+    methode="L-BFGS-B",
+    depart="milieu",
+    departs_multiples=0,
 ):
     """
     détermination de la position par les dérivées numériques calculées avec la méthode `methode`"
+
+    Pour les méthodes de `GRADIENT_METHODS` le gradient de la MSE est fourni analytiquement.
+    Si `methode` vaut "least_squares", la position est obtenue par moindres carrés
+    (`scipy.optimize.least_squares`) sur le vecteur des écarts et sa jacobienne.
+
+    `depart` choisit le point de départ de l'optimisation, voir `point_de_depart`.
+    Si `departs_multiples` est non nul, autant de points supplémentaires sont choisis
+    parmi une grille couvrant `dims`. Ils sont tous affinés à la fois par le
+    Levenberg-Marquardt vectorisé de `methode_jointe` (et non par `methode`),
+    puis la meilleure position est retenue.
+    Si l'optimisation échoue, la meilleure position rencontrée (départ ou arrivée) est retenue.
     """
     (x0, y0, width, height) = dims
     if width * height < epsilon:
         esp["predicted_position"] = middle_rect(dims)
+        return None
+
+    ref_coords, ref_distances = usable_references(
+        *references_arrays(ref_esps, distances)
+    )
+    starts = [point_de_depart(esp, ref_coords, ref_distances, dims, depart)]
+    if ref_distances.size == 0:
+        # the score doesn't depend on the position, we stay where we start
+        esp["predicted_position"] = starts[0]
+        return None
+    if departs_multiples > 0:
+        starts.extend(
+            _grille_de_departs(ref_coords, ref_distances, dims, departs_multiples)
+        )
+
+    candidates = [starts[0]]
+    outcome = _optimise(starts[0], ref_coords, ref_distances, methode)
+    if np.all(np.isfinite(outcome.x)):
+        candidates.append(outcome.x)
+    if len(starts) > 1:
+        candidates.extend(_departs_multiples(starts[1:], ref_coords, ref_distances))
+
+    # all the starting and ending points are scored at once
+    candidates = np.array(candidates, dtype=float)
+    best = candidates[np.argmin(MSE_batch(candidates, ref_coords, ref_distances))]
+    esp["predicted_position"] = (best[0], best[1])
+
+
+def _optimise(start, ref_coords, ref_distances, methode):
+    """
+    Lance l'optimisation `methode` (voir `methode_gradient`) depuis `start`.
+    """
+    if methode == "least_squares":
+        outcome = opti.least_squares(
+            residuals,
+            start,
+            jac=residuals_jacobian,
+            args=(ref_coords, ref_distances),
+        )
     else:
-        # starting from the middle of the space we use the MSE
-        # as the scoring function to orient the gradient
+        # we use the MSE as the scoring function to orient the gradient
         outcome = opti.minimize(
-            lambda pos: MSE(pos, ref_esps, distances), middle_rect(dims), method=methode
+            lambda pos: MSE_batch(pos, ref_coords, ref_distances)[0],
+            start,
+            method=methode,
+            jac=(
+                (lambda pos: MSE_gradient(pos, ref_coords, ref_distances))
+                if methode in GRADIENT_METHODS
+                else None
+            ),
         )
 
-        if outcome.success:
-            esp["predicted_position"] = (outcome.x[0], outcome.x[1])
-        else:
-            esp["predicted_position"] = random_uniform_pos(dims)
+    if instrumentation.actif:
+        # `least_squares` doesn't count iterations but Jacobian evaluations
+        instrumentation.compter(
+            "iterations_optimiseur", getattr(outcome, "nit", outcome.get("njev") or 0)
+        )
+        if not outcome.success:
+            instrumentation.compter("echecs_optimiseur")
+    return outcome
+
+
+def point_de_depart(esp, ref_coords, ref_distances, dims, depart="milieu"):
+    """
+    Une estimation grossière de la position de `esp`, servant de point de départ.
+
+    `ref_coords` et `ref_distances` sont les ESPs de référence à portée
+    (voir `esp8266.usable_references`). `depart` vaut:
+    - "milieu" : le milieu de `dims`
+    - "partition" : quelques niveaux de la méthode des partitions
+    - "barycentre" : le barycentre des ESPs de référence à portée, pondéré par l'inverse des distances
+    - "precedent" : la position estimée précédemment ("predicted_position"), ou le barycentre à défaut
+
+    Retourne un tuple de floats.
+    """
+    if depart == "milieu" or ref_distances.size == 0:
+        return middle_rect(dims)
+    if depart == "precedent":
+        if "predicted_position" in esp:
+            return tuple(esp["predicted_position"])
+        depart = "barycentre"
+    if depart == "barycentre":
+        # the closer the reference, the greater its weight
+        weights = 1 / np.maximum(ref_distances, DISTANCE_MIN)
+        x, y = weights @ ref_coords / weights.sum()
+        return (x, y)
+    if depart == "partition":
+        return _partition(ref_coords, ref_distances, dims, niveaux=4)
+    raise ValueError(f"Unknown starting point {depart!r}")
+
+
+def _departs_multiples(starts, ref_coords, ref_distances, iterations=100):
+    """
+    Les points de départ `starts`, suivis des positions obtenues en les affinant tous
+    d'un bloc par Levenberg-Marquardt (voir `_levenberg_marquardt`).
+    """
+    starts = np.array(starts, dtype=float).reshape(-1, 2)
+    count = len(starts)
+    refined = starts.copy()
+    _levenberg_marquardt(
+        refined,
+        np.broadcast_to(ref_distances, (count, len(ref_distances))),
+        np.broadcast_to(ref_coords, (count, *ref_coords.shape)),
+        np.ones((count, len(ref_distances)), dtype=bool),
+        np.ones(count, dtype=bool),
+        iterations,
+        1e-9,
+        "iterations_departs",
+    )
+    return [*starts, *refined]
+
+
+def _grille_de_departs(ref_coords, ref_distances, dims, count):
+    """
+    Les `count` meilleurs points d'une grille couvrant `dims`, notés d'un seul bloc.
+    """
+    (x0, y0, width, height) = dims
+    # a few more cells than needed so that the best ones are spread out
+    side = int(np.ceil(np.sqrt(4 * count)))
+    xs = x0 + (np.arange(side) + 0.5) * width / side
+    ys = y0 + (np.arange(side) + 0.5) * height / side
+    grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+    scores = MSE_batch(grid, ref_coords, ref_distances)
+    return list(grid[np.argsort(scores)[:count]])
+
+
+def methode_grille(
+    esp,
+    ref_esps,
+    distances,
+    dims,
+    *,
+    grille=None,
+    resolution=None,
+    methode="least_squares",
+):
+    """
+    détermination de la position par lecture d'une grille de distances précalculée
+
+    `grille` est une `grid.DistanceGrid` construite sur `ref_esps` et `dims`, qui donne
+    la meilleure cellule sans calculer de distance. Sa position est ensuite affinée
+    localement par `methode` (voir `methode_gradient`), sauf si `methode` vaut `None`.
+    Sans `grille`, celle de `ref_esps` et `dims` est construite au premier appel
+    avec des cellules de côté `resolution`, puis réutilisée (voir `_grille`).
+    """
+    ref_coords, ref_distances = references_arrays(ref_esps, distances)
+    if grille is None:
+        grille = _grille(ref_coords, dims, resolution)
+    start = grille.best_cell(ref_distances)
+    if start is None:
+        # the score doesn't depend on the position
+        esp["predicted_position"] = middle_rect(dims)
+        return None
+    if methode is None:
+        esp["predicted_position"] = start
+        return None
+
+    ref_coords, ref_distances = usable_references(ref_coords, ref_distances)
+    outcome = _optimise(start, ref_coords, ref_distances, methode)
+    candidates = np.array([start, outcome.x], dtype=float)
+    candidates = candidates[np.all(np.isfinite(candidates), axis=1)]
+    best = candidates[np.argmin(MSE_batch(candidates, ref_coords, ref_distances))]
+    esp["predicted_position"] = (best[0], best[1])
+
+
+# the grid built by the last call to `_grille`, in each process
+_derniere_grille = None
+
+
+def _grille(ref_coords, dims, resolution=None):
+    """
+    La `grid.DistanceGrid` des ESPs de référence en `ref_coords` sur `dims`, construite
+    une fois tant que ses paramètres ne changent pas.
+
+    Par défaut, la plus grande dimension de `dims` compte `CELLULES_GRILLE` cellules.
+    """
+    global _derniere_grille
+    (_, _, width, height) = dims
+    if resolution is None:
+        resolution = max(width, height) / CELLULES_GRILLE or 1.0
+    grid = _derniere_grille
+    if (
+        grid is None
+        or grid.dims != tuple(dims)
+        or grid.resolution != resolution
+        or not np.array_equal(grid.ref_coords, ref_coords)
+    ):
+        grid = _derniere_grille = DistanceGrid.build(
+            [{"coordinates": pos} for pos in ref_coords], dims, resolution
+        )
+    return grid
 
 
 def apply_method(
@@ -115,12 +462,403 @@ def apply_method(
 ):
     """
     Applique `methode_interpolation` à tout les `ESPs`.
+
+    `esps` peut être une liste d'ESPs ou une `fleet.Fleet`, auquel cas les positions
+    estimées sont écrites directement dans la flotte.
+    Les méthodes de `METHODES_GLOBALES` sont appliquées d'un seul appel à tout les ESPs.
+
+    Retourne la liste des ids des ESPs hors de portée de tout ESP de référence
+    (voir `HorsDePortee`), dont la position estimée n'est pas modifiée.
     """
+    # progress goes to stderr, stdout may carry results (see `main.localiser`)
     print(
-        f"Applying {methode_interpolation.__name__} method (with args={args} and kwargs={kwargs}"
+        f"Applying {methode_interpolation.__name__} method (with args={args} and kwargs={kwargs}",
+        file=sys.stderr,
     )
+    with instrumentation.chronometre(_etape(methode_interpolation, kwargs)):
+        if methode_interpolation in METHODES_GLOBALES:
+            methode_interpolation(esps, ref_esps, distances, dims, *args, **kwargs)
+            return []
+        targets = [esp for esp in esps if not esp["reference_node"]]
+        return _localiser(
+            targets, ref_esps, distances, dims, methode_interpolation, args, kwargs
+        )
+
+
+def _localiser(esps, ref_esps, distances, dims, methode_interpolation, args, kwargs):
+    """
+    Applique `methode_interpolation` à chacun des `esps`, qui ne sont pas de référence.
+
+    Seuls les ESPs hors de portée (`HorsDePortee`) sont passés, toute autre erreur
+    de la méthode est propagée. Retourne la liste de leurs ids.
+    """
+    hors_de_portee = []
     for esp in esps:
-        if not esp["reference_node"]:
+        try:
             methode_interpolation(
                 esp, ref_esps, distances[esp["id"]], dims, *args, **kwargs
             )
+        except HorsDePortee:
+            hors_de_portee.append(esp["id"])
+    return hors_de_portee
+
+
+def _etape(methode_interpolation, kwargs):
+    """
+    Le nom sous lequel la localisation par `methode_interpolation` est chronométrée.
+    """
+    options = ", ".join(f"{key}={value}" for key, value in kwargs.items())
+    return f"localisation.{methode_interpolation.__name__}({options})"
+
+
+def methode_jointe(
+    esps, ref_esps, distances, dims, *, epsilon=0.01, iterations=100, tolerance=1e-9
+):
+    """
+    détermination simultanée de la position de tout les ESPs par Levenberg-Marquardt
+
+    Contrairement aux autres méthodes, celle-ci s'applique directement à l'ensemble
+    des `esps` (sans `apply_method`) : `distances` est le dictionnaire associant l'id
+    de chaque ESP à ses distances aux `ref_esps` (voir `main.methods_comparison`).
+    Les positions de tout les ESPs sont rangées dans un même tableau et chaque itération
+    les met toutes à jour d'un bloc. Un ESP cesse d'être mis à jour dès que son pas
+    devient inférieur à `tolerance`. Les ESPs n'ayant aucun ESP de référence à portée
+    sont placés au milieu de `dims`.
+    """
+    targets = [esp for esp in esps if not esp["reference_node"]]
+    if not targets:
+        return None
+    (x0, y0, width, height) = dims
+    if width * height < epsilon:
+        for esp in targets:
+            esp["predicted_position"] = middle_rect(dims)
+        return None
+
+    ref_coords = np.array(
+        [ref_esp["coordinates"] for ref_esp in ref_esps], dtype=float
+    ).reshape(-1, 2)
+    # `None` distances become `nan`
+    all_distances = np.array(
+        [distances[esp["id"]] for esp in targets], dtype=float
+    ).reshape(len(targets), len(ref_coords))
+
+    # only the references in range of each node are kept, padded to the same count
+    in_range = ~np.isnan(all_distances)
+    width_k = max(int(in_range.sum(axis=1).max()), 1)
+    order = np.argsort(~in_range, axis=1, kind="stable")[:, :width_k]
+    mask = np.take_along_axis(in_range, order, axis=1)
+    real = np.where(mask, np.take_along_axis(all_distances, order, axis=1), 0.0)
+    coords = ref_coords[order] if len(ref_coords) else np.zeros((len(targets), 1, 2))
+
+    # starting point: inverse distance weighted centroid of the references in range
+    weights = np.where(mask, 1 / np.maximum(real, DISTANCE_MIN), 0.0)
+    total = weights.sum(axis=1)
+    located = total > 0
+    positions = np.tile(np.array(middle_rect(dims), dtype=float), (len(targets), 1))
+    positions[located] = (
+        np.einsum("nk,nki->ni", weights[located], coords[located])
+        / total[located, None]
+    )
+
+    _levenberg_marquardt(
+        positions,
+        real,
+        coords,
+        mask,
+        located,
+        iterations,
+        tolerance,
+        "iterations_jointe",
+    )
+
+    for esp, (x, y) in zip(targets, positions):
+        esp["predicted_position"] = (x, y)
+
+
+def _levenberg_marquardt(
+    positions, real, coords, mask, active, iterations, tolerance, compteur
+):
+    """
+    Affine en place les N `positions` (N, 2) par Levenberg-Marquardt, toutes à la fois.
+
+    Chaque position a ses propres ESPs de référence : `coords` (N, K, 2) et les distances
+    `real` (N, K), dont seules celles de `mask` (N, K) comptent. Seules les positions
+    de `active` (un masque (N,)) sont mises à jour, jusqu'à ce que leur pas soit inférieur
+    à `tolerance` ou au plus `iterations` fois. Chaque itération est comptée sous
+    `compteur` par l'instrumentation.
+    """
+
+    def cost_and_derivatives(pos, real, coords, mask):
+        offsets = pos[:, None, :] - coords
+        norms = np.hypot(offsets[..., 0], offsets[..., 1])
+        res = np.where(mask, norms - real, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            jac = np.where(
+                (mask & (norms > 0))[..., None], offsets / norms[..., None], 0.0
+            )
+        return (res ** 2).sum(axis=1), res, jac
+
+    damping = np.full(len(positions), 1e-3)
+    active = np.flatnonzero(active)
+    for _ in range(iterations):
+        if active.size == 0:
+            break
+        if instrumentation.actif:
+            instrumentation.compter(compteur)
+        pos, r, c, m = positions[active], real[active], coords[active], mask[active]
+        cost, res, jac = cost_and_derivatives(pos, r, c, m)
+
+        # 2x2 damped normal equations of every position, solved in closed form
+        a = np.einsum("nki,nkj->nij", jac, jac)
+        g = np.einsum("nki,nk->ni", jac, res)
+        lam = damping[active]
+        a11 = a[:, 0, 0] * (1 + lam) + 1e-12
+        a22 = a[:, 1, 1] * (1 + lam) + 1e-12
+        a12 = a[:, 0, 1]
+        det = a11 * a22 - a12 * a12
+        step = -np.stack(
+            (
+                (a22 * g[:, 0] - a12 * g[:, 1]) / det,
+                (a11 * g[:, 1] - a12 * g[:, 0]) / det,
+            ),
+            axis=1,
+        )
+
+        new_cost, _, _ = cost_and_derivatives(pos + step, r, c, m)
+        better = new_cost < cost
+        positions[active[better]] += step[better]
+        damping[active] = np.where(better, lam / 10, lam * 10)
+
+        converged = (np.hypot(step[:, 0], step[:, 1]) < tolerance) | (
+            damping[active] > 1e10
+        )
+        active = active[~converged]
+
+
+# context shared with the workers of `apply_method_parallel` and `comparer_methodes`,
+# set once per process
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _localise_chunk(chunk, context=None):
+    """
+    Localise un paquet d'ESPs avec le contexte partagé du processus (ou `context`).
+
+    Retourne les positions estimées, dans l'ordre du paquet, et les ids des ESPs hors
+    de portée, ainsi que les mesures de l'instrumentation s'il s'agit d'un autre processus
+    (voir `instrumentation.isoler`).
+    """
+    if context is not None:
+        return _localise(chunk, *context), None
+
+    (*context, instrumented) = _worker_context
+    with instrumentation.isoler(instrumented) as measures:
+        outcome = _localise(chunk, *context)
+    return outcome, measures
+
+
+def _localise(chunk, ref_esps, dims, methode_interpolation, args, kwargs):
+    esps = []
+    for identifier, _, previous in chunk:
+        esp = {"id": identifier, "reference_node": False}
+        if previous is not None:
+            esp["predicted_position"] = previous
+        esps.append(esp)
+    distances = {identifier: distances for identifier, distances, _ in chunk}
+    hors_de_portee = _localiser(
+        esps, ref_esps, distances, dims, methode_interpolation, args, kwargs
+    )
+    return [esp.get("predicted_position") for esp in esps], hors_de_portee
+
+
+def apply_method_parallel(
+    esps,
+    ref_esps,
+    distances,
+    dims,
+    methode_interpolation,
+    *args,
+    backend="process",
+    workers=None,
+    chunksize=64,
+    **kwargs,
+):
+    """
+    Applique `methode_interpolation` à tout les `ESPs`, comme `apply_method`,
+    mais en répartissant les ESPs entre plusieurs processus ou threads.
+
+    `backend` vaut "process" ou "thread" et `workers` est le nombre de processus ou threads
+    (par défaut le nombre de coeurs). Les ESPs sont envoyés par paquets de `chunksize`.
+    Les ESPs de référence ne sont transmis qu'une fois à chaque processus.
+    Les positions estimées sont écrites dans les ESPs dans leur ordre d'origine.
+    Les méthodes de `METHODES_GLOBALES`, qui localisent déjà tout les ESPs à la fois,
+    sont appliquées par `apply_method`.
+
+    Retourne, comme `apply_method`, la liste des ids des ESPs hors de portée.
+    """
+    if methode_interpolation in METHODES_GLOBALES:
+        return apply_method(
+            esps, ref_esps, distances, dims, methode_interpolation, *args, **kwargs
+        )
+    print(
+        f"Applying {methode_interpolation.__name__} method in parallel ({backend} backend, with args={args} and kwargs={kwargs}",
+        file=sys.stderr,
+    )
+    targets = [esp for esp in esps if not esp["reference_node"]]
+    tasks = [
+        (esp["id"], distances[esp["id"]], esp.get("predicted_position"))
+        for esp in targets
+    ]
+    chunks = [tasks[i : i + chunksize] for i in range(0, len(tasks), chunksize)]
+
+    if backend == "process":
+        # plain copies of the references, pickled once per worker
+        context = (
+            [_plain_esp(ref_esp) for ref_esp in ref_esps],
+            dims,
+            methode_interpolation,
+            args,
+            kwargs,
+            instrumentation.actif,
+        )
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(context,)
+        )
+        localise = _localise_chunk
+    elif backend == "thread":
+        # threads share the memory of the process: no copy is needed
+        context = (ref_esps, dims, methode_interpolation, args, kwargs)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        localise = partial(_localise_chunk, context=context)
+    else:
+        raise ValueError(f"Unknown backend {backend!r}, expected 'process' or 'thread'")
+
+    with instrumentation.chronometre(_etape(methode_interpolation, kwargs)), executor:
+        results = list(executor.map(localise, chunks))
+
+    # the chunks keep the order of `targets`
+    predictions = []
+    hors_de_portee = []
+    for (chunk_predictions, chunk_hors_de_portee), measures in results:
+        predictions.extend(chunk_predictions)
+        hors_de_portee.extend(chunk_hors_de_portee)
+        if measures is not None and instrumentation.actif:
+            instrumentation.fusionner(measures)
+    assert len(predictions) == len(targets), "every ESP must get one prediction"
+    for esp, prediction in zip(targets, predictions):
+        if prediction is not None:
+            esp["predicted_position"] = prediction
+    return hors_de_portee
+
+
+def _plain_esp(esp):
+    return {
+        key: dict(value) if isinstance(value, Mapping) else value
+        for key, value in esp.items()
+    }
+
+
+# methods locating all the ESPs in a single call, with the distances of every ESP
+METHODES_GLOBALES = (methode_jointe,)
+
+# (name, title, method, kwargs) of the localisation methods: the name selects a method
+# (`main.py localize`, `bench.py`), the title labels it (`main.methods_comparison`)
+METHODES = (
+    ("partition", "Méthode par partition", methode_partition, {}),
+    ("MonteCarlo", "Méthode de Monté-Carlo", methode_MonteCarlo, {}),
+    *(
+        (
+            f"gradient ({solver})",
+            f"Méthode du gradient ({solver})",
+            methode_gradient,
+            {"methode": solver},
+        )
+        for solver in (
+            "Nelder-Mead",
+            "Powell",
+            "CG",
+            "BFGS",
+            "L-BFGS-B",
+            "TNC",
+            "COBYLA",
+            "SLSQP",
+        )
+    ),
+    ("jointe", "Méthode jointe (Levenberg-Marquardt)", methode_jointe, {}),
+    ("grille", "Méthode de la grille", methode_grille, {}),
+)
+
+
+def comparer_methodes(
+    esps, ref_esps, distances, dims, methodes=METHODES, *, workers=None
+):
+    """
+    Applique chacune des `methodes` à tout les `esps`, chaque méthode dans son propre processus.
+
+    `methodes` est une séquence de tuples (nom, titre, méthode, kwargs), voir `METHODES`.
+    Les `esps` ne sont pas modifiés : les positions estimées par chaque méthode sont conservées
+    à part. Les données du réseau ne sont transmises qu'une fois à chaque processus.
+    Si `workers` vaut 1, les méthodes sont appliquées successivement dans le processus courant.
+
+    Retourne un dictionnaire associant à chaque nom de méthode un dictionnaire
+    id de l'ESP -> position estimée (`None` si la méthode n'a pu être appliquée à l'ESP).
+    """
+    targets = [esp for esp in esps if not esp["reference_node"]]
+    context = (
+        [(esp["id"], distances[esp["id"]]) for esp in targets],
+        [_plain_esp(ref_esp) for ref_esp in ref_esps],
+        dims,
+        instrumentation.actif,
+    )
+    tasks = [(methode, kwargs) for (_, _, methode, kwargs) in methodes]
+
+    if workers == 1:
+        results = [_comparer(task, context) for task in tasks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(context,)
+        ) as executor:
+            results = list(executor.map(_comparer, tasks))
+
+    table = {}
+    for (name, _, _, _), (predictions, measures) in zip(methodes, results):
+        table[name] = predictions
+        if measures is not None and instrumentation.actif:
+            instrumentation.fusionner(measures)
+    return table
+
+
+def _comparer(task, context=None):
+    """
+    Applique une méthode (`task`) à tout les ESPs du contexte partagé du processus (ou `context`).
+
+    Retourne les positions estimées par id, ainsi que les mesures de l'instrumentation
+    s'il s'agit d'un autre processus.
+    """
+    if context is not None:
+        return _comparer_avec(task, *context[:3]), None
+
+    (*context, instrumented) = _worker_context
+    with instrumentation.isoler(instrumented) as measures:
+        predictions = _comparer_avec(task, *context)
+    return predictions, measures
+
+
+def _comparer_avec(task, targets, ref_esps, dims):
+    (methode_interpolation, kwargs) = task
+    esps = [{"id": identifier, "reference_node": False} for identifier, _ in targets]
+    distances = dict(targets)
+    with instrumentation.chronometre(_etape(methode_interpolation, kwargs)):
+        if methode_interpolation in METHODES_GLOBALES:
+            methode_interpolation(esps, ref_esps, distances, dims, **kwargs)
+        else:
+            # the ESPs out of range keep no predicted position
+            _localiser(
+                esps, ref_esps, distances, dims, methode_interpolation, (), kwargs
+            )
+    return {esp["id"]: esp.get("predicted_position") for esp in esps}
@@ -0,0 +1,240 @@
+# Pilotes de mesure des signaux.
+# Un pilote fournit les puissances (RSSI) reçues par un ESP et émises par un autre.
+# Dans une situation pratique il interrogerait les ESPs, ici deux pilotes sont proposés :
+# - `PiloteSimule` simule les signaux dans le processus, comme `utils.stream_signals`
+# - `PiloteTCP` les demande à un serveur, tel `ServeurSimule` qui simule des ESPs
+#   derrière une connexion TCP locale
+# Les pilotes sont asynchrones : les signaux de nombreux liens peuvent être demandés
+# simultanément (voir `esp8266.signal_moyen_async` et `esp8266.calibrage_references`).
+
+import asyncio
+import struct
+import threading
+from contextlib import contextmanager
+import numpy as np
+from utils import distance
+from esp8266 import link_rng, mean_power
+
+
+# request: emitter id, receiver id, amount of signals
+REQUETE = struct.Struct("<qqI")
+# response header: amount of signals, followed by as many float64
+REPONSE = struct.Struct("<I")
+
+
+class Pilote:
+    """
+    Interface commune des pilotes.
+
+    Les signaux sont fournis par lots d'au plus `lot` valeurs.
+    """
+
+    lot = 1 << 16
+
+    async def signaux(self, emetteur, receveur, amount):
+        """
+        Générateur asynchrone des `amount` signaux émis par `emetteur` et reçus
+        par `receveur`, par tableaux d'au plus `lot` valeurs.
+        """
+        raise NotImplementedError
+        yield
+
+    async def fermer(self):
+        """
+        Libère les ressources du pilote (connexions...).
+        """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.fermer()
+
+
+class PiloteSimule(Pilote):
+    """
+    Simule les signaux dans le processus, suivant le modèle de `esp8266.signal_moyen` :
+    chaque lien a son propre générateur (voir `esp8266.link_rng`) dérivé de `seed`.
+    """
+
+    def __init__(self, seed=None, *, lot=1 << 16):
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.lot = lot
+        # (emitter id, receiver id) -> generator
+        self._generateurs = {}
+
+    async def signaux(self, emetteur, receveur, amount):
+        rng = self._generateurs.get((emetteur["id"], receveur["id"]))
+        if rng is None:
+            rng = link_rng(self.seed, emetteur, receveur)
+            self._generateurs[(emetteur["id"], receveur["id"])] = rng
+        d = distance(emetteur["coordinates"], receveur["coordinates"])
+        real_mean = mean_power(d, emetteur["path_loss_params"])
+        sigma = emetteur["path_loss_params"]["sigma"]
+
+        while amount > 0:
+            count = min(amount, self.lot)
+            yield rng.normal(real_mean, sigma, count)
+            amount -= count
+            # let the other links run
+            await asyncio.sleep(0)
+
+
+class PiloteTCP(Pilote):
+    """
+    Demande les signaux à un serveur TCP (voir `ServeurSimule` pour le protocole).
+
+    Au plus `connexions` connexions sont ouvertes, et donc au plus autant de lots demandés
+    à la fois : les autres demandes attendent qu'une connexion se libère. Les lots
+    font au plus `lot` valeurs, ce qui borne la mémoire utilisée par les réponses en attente.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8266, *, connexions=16, lot=4096):
+        self.host = host
+        self.port = port
+        self.connexions = connexions
+        self.lot = lot
+        self._libres = None
+        self._ouvertes = []
+        self._nombre = 0
+
+    async def _connexion(self):
+        if self._libres is None:
+            self._libres = asyncio.Queue()
+        if self._libres.empty() and self._nombre < self.connexions:
+            return await self._ouvrir()
+        connection = await self._libres.get()
+        if connection is None:
+            # the slot of an abandoned connection
+            return await self._ouvrir()
+        return connection
+
+    async def _ouvrir(self):
+        # counted before being opened, other requests may run meanwhile
+        self._nombre += 1
+        try:
+            connection = await asyncio.open_connection(self.host, self.port)
+        except BaseException:
+            self._nombre -= 1
+            raise
+        self._ouvertes.append(connection)
+        return connection
+
+    def _abandonner(self, connection):
+        """
+        Ferme `connection`, dont le flux n'est plus synchronisé avec le serveur,
+        et libère sa place pour une nouvelle connexion.
+        """
+        (_, writer) = connection
+        writer.close()
+        self._ouvertes.remove(connection)
+        self._nombre -= 1
+        # wakes up a request waiting for a connection, it will open a new one
+        self._libres.put_nowait(None)
+
+    async def signaux(self, emetteur, receveur, amount):
+        while amount > 0:
+            count = min(amount, self.lot)
+            (reader, writer) = connection = await self._connexion()
+            try:
+                writer.write(REQUETE.pack(emetteur["id"], receveur["id"], count))
+                await writer.drain()
+                (count,) = REPONSE.unpack(await reader.readexactly(REPONSE.size))
+                data = await reader.readexactly(8 * count)
+            except BaseException:
+                # part of the response may be left unread
+                self._abandonner(connection)
+                raise
+            self._libres.put_nowait(connection)
+            yield np.frombuffer(data, dtype="<f8")
+            amount -= count
+
+    async def fermer(self):
+        for (_, writer) in self._ouvertes:
+            writer.close()
+        for (_, writer) in self._ouvertes:
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+        self._ouvertes = []
+        self._libres = None
+        self._nombre = 0
+
+
+class ServeurSimule:
+    """
+    Serveur TCP simulant les ESPs `esps`, pour `PiloteTCP`.
+
+    Chaque requête (`REQUETE`) contient les ids de l'émetteur et du receveur et le nombre
+    de signaux voulus. La réponse (`REPONSE`) donne le nombre de signaux, suivi d'autant
+    de flottants (float64, petit-boutiste). Les signaux suivent le même modèle que
+    `PiloteSimule`, avec la même graine `seed` ils sont donc identiques.
+
+    S'utilise comme un gestionnaire de contexte asynchrone, `port` valant 0 un port libre
+    est choisi (voir l'attribut `port` une fois le serveur démarré).
+    """
+
+    def __init__(self, esps, *, seed=None, host="127.0.0.1", port=0):
+        self.esps = {esp["id"]: esp for esp in esps}
+        self.host = host
+        self.port = port
+        self._pilote = PiloteSimule(seed)
+        self._server = None
+
+    async def demarrer(self):
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def arreter(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.demarrer()
+
+    async def __aexit__(self, *exc):
+        await self.arreter()
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await reader.readexactly(REQUETE.size)
+                except asyncio.IncompleteReadError:
+                    break
+                (emetteur, receveur, amount) = REQUETE.unpack(request)
+                writer.write(REPONSE.pack(amount))
+                async for signals in self._pilote.signaux(
+                    self.esps[emetteur], self.esps[receveur], amount
+                ):
+                    writer.write(signals.astype("<f8").tobytes())
+                await writer.drain()
+        except ConnectionError:
+            # the client closed the connection (see `PiloteTCP._abandonner`)
+            pass
+        finally:
+            writer.close()
+
+
+@contextmanager
+def serveur_simule(esps, *, seed=None, host="127.0.0.1", port=0):
+    """
+    Démarre un `ServeurSimule` dans un thread, le temps du bloc `with`.
+
+    Donne le serveur, dont le `port` est connu : il peut alors servir un `PiloteTCP`
+    utilisé depuis le thread principal (par `esp8266.calibrage_references` par exemple).
+    """
+    loop = asyncio.new_event_loop()
+    server = ServeurSimule(esps, seed=seed, host=host, port=port)
+    loop.run_until_complete(server.demarrer())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.arreter(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
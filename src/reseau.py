@@ -0,0 +1,275 @@
+# Modèle incrémental d'un réseau d'ESPs.
+# Plutôt que de tout recalculer à chaque changement du réseau, `Reseau` garde le calibrage
+# des ESPs de référence, les distances aux ESPs de référence à portée et les positions estimées,
+# et ne recalcule que ce qui dépend des ESPs ajoutés, retirés, déplacés ou modifiés.
+
+from math import ceil, inf
+import numpy as np
+from utils import distance
+from esp8266 import PORTEE, calibrage_references, deux_plus_proches_voisins
+from methods import methode_gradient
+from spatial import SpatialIndex
+
+
+class _Grille:
+    """
+    Répartition d'ESPs dans des cellules carrées de côté `cote`, pour trouver rapidement
+    les ESPs proches d'une position. Contrairement à un `spatial.SpatialIndex`,
+    ajouter ou retirer un ESP ne demande pas de tout reconstruire.
+    """
+
+    def __init__(self, cote=PORTEE):
+        self.cote = cote
+        # (column, row) -> ids of the ESPs in the cell
+        self.cellules = {}
+
+    def _cellule(self, pos):
+        (x, y) = pos
+        return (int(x // self.cote), int(y // self.cote))
+
+    def ajouter(self, identifier, pos):
+        self.cellules.setdefault(self._cellule(pos), set()).add(identifier)
+
+    def retirer(self, identifier, pos):
+        cell = self._cellule(pos)
+        self.cellules[cell].discard(identifier)
+        if not self.cellules[cell]:
+            del self.cellules[cell]
+
+    def autour(self, pos, rayon):
+        """
+        Les ids des ESPs des cellules à moins de `rayon` de `pos` (un sur-ensemble des ESPs
+        à moins de `rayon`), ou de toutes les cellules si `rayon` est infini.
+        """
+        if rayon == inf or not self.cellules:
+            return [i for ids in self.cellules.values() for i in ids]
+        (col, row) = self._cellule(pos)
+        reach = ceil(rayon / self.cote)
+        if (2 * reach + 1) ** 2 > len(self.cellules):
+            # fewer occupied cells than cells to visit
+            cells = self.cellules.values()
+        else:
+            cells = (
+                self.cellules.get((col + i, row + j), ())
+                for i in range(-reach, reach + 1)
+                for j in range(-reach, reach + 1)
+            )
+        return [i for ids in cells for i in ids]
+
+
+class Reseau:
+    """
+    Réseau d'ESPs dans l'espace `dims`, tenu à jour de façon incrémentale.
+
+    Les ESPs sont ajoutés, retirés, déplacés ou modifiés avec `ajouter`, `retirer`, `deplacer`
+    et `modifier`, qui ne font que noter ce qui doit être recalculé :
+    - le calibrage d'un ESP de référence dépend de ses caractéristiques et de la position
+    de ses deux plus proches voisins (voir `esp8266.calibrage_references`)
+    - les distances d'un ESP aux ESPs de référence à portée (voir `PORTEE`)
+    - la position estimée d'un ESP, qui dépend de ces distances
+
+    `mettre_a_jour` effectue ensuite les calculs en attente.
+    Les positions sont estimées par `methode` (appelée avec les `options`) à partir des seuls
+    ESPs de référence à portée. Avec `depart="precedent"` (voir `methods.methode_gradient`),
+    la position estimée précédemment sert de point de départ.
+    Le calibrage utilise la graine `seed` (tirée au hasard si absente), de sorte qu'un ESP
+    de référence recalibré dans les mêmes conditions retrouve les mêmes caractéristiques.
+    """
+
+    def __init__(
+        self,
+        dims,
+        esps=(),
+        *,
+        methode=methode_gradient,
+        epsilon=0.01,
+        seed=None,
+        workers=None,
+        **options,
+    ):
+        self.dims = dims
+        self.methode = methode
+        self.options = options
+        self.epsilon = epsilon
+        self.seed = np.random.SeedSequence().entropy if seed is None else seed
+        self.workers = workers
+
+        # id -> ESP
+        self.esps = {}
+        # id -> reference ESP, in the order of `esps`
+        self._refs = {}
+        self._references = _Grille()
+        self._noeuds = _Grille()
+        # reference id -> ids of its two nearest references, used for its calibration
+        self._voisins = {}
+        # reference id -> distance to the farthest of its two nearest references
+        self._rayons = {}
+        # reference id -> ids of the references whose calibration uses it
+        self._calibres_par = {}
+        # node id -> {reference id -> distance}, for the references in range
+        self.distances = {}
+        # reference id -> ids of the nodes in its range
+        self._couverts = {}
+
+        # ids whose calibration or position must be computed again
+        self.a_calibrer = set()
+        self.a_localiser = set()
+
+        for esp in esps:
+            self.ajouter(esp)
+
+    def ajouter(self, esp):
+        """
+        Ajoute `esp` au réseau.
+        """
+        identifier = esp["id"]
+        assert identifier not in self.esps, f"ESP {identifier} is already there"
+        self.esps[identifier] = esp
+        pos = esp["coordinates"]
+
+        if not esp["reference_node"]:
+            self._noeuds.ajouter(identifier, pos)
+            self.distances[identifier] = {}
+            for ref_id in self._references.autour(pos, PORTEE):
+                self._lier(identifier, ref_id)
+            self.a_localiser.add(identifier)
+            return
+
+        # references for which it is now one of the two nearest neighbours
+        rayon = max(self._rayons.values(), default=inf)
+        for ref_id in self._references.autour(pos, rayon):
+            ref_pos = self.esps[ref_id]["coordinates"]
+            if distance(ref_pos, pos) < self._rayons.get(ref_id, inf):
+                self.a_calibrer.add(ref_id)
+        self._references.ajouter(identifier, pos)
+        self._refs[identifier] = esp
+        self._couverts[identifier] = set()
+        self._calibres_par[identifier] = set()
+        self.a_calibrer.add(identifier)
+
+        for node_id in self._noeuds.autour(pos, PORTEE):
+            self._lier(node_id, identifier)
+
+    def retirer(self, identifier):
+        """
+        Retire l'ESP `identifier` du réseau et le retourne.
+        """
+        esp = self.esps.pop(identifier)
+        pos = esp["coordinates"]
+
+        if not esp["reference_node"]:
+            self._noeuds.retirer(identifier, pos)
+            for ref_id in self.distances.pop(identifier):
+                self._couverts[ref_id].discard(identifier)
+            self.a_localiser.discard(identifier)
+            return esp
+
+        self._references.retirer(identifier, pos)
+        del self._refs[identifier]
+        for node_id in self._couverts.pop(identifier):
+            del self.distances[node_id][identifier]
+            self.a_localiser.add(node_id)
+        # the references calibrated with it need new neighbours
+        self.a_calibrer |= self._calibres_par.pop(identifier)
+        self.a_calibrer.discard(identifier)
+        for ref_id in self._voisins.pop(identifier, ()):
+            if ref_id in self._calibres_par:
+                self._calibres_par[ref_id].discard(identifier)
+        self._rayons.pop(identifier, None)
+        return esp
+
+    def deplacer(self, identifier, coordinates):
+        """
+        Déplace l'ESP `identifier` en `coordinates`.
+        """
+        esp = self.retirer(identifier)
+        esp["coordinates"] = coordinates
+        self.ajouter(esp)
+
+    def modifier(self, identifier, **params):
+        """
+        Modifie les caractéristiques ("path_loss_params") `params` de l'ESP `identifier`.
+
+        Seul le calibrage d'un ESP de référence dépend de ses caractéristiques.
+        """
+        esp = self.esps[identifier]
+        esp["path_loss_params"].update(params)
+        if esp["reference_node"]:
+            self.a_calibrer.add(identifier)
+
+    def _lier(self, node_id, ref_id):
+        """
+        Enregistre la distance du noeud `node_id` à l'ESP de référence `ref_id` s'il est à portée.
+        """
+        d = distance(
+            self.esps[node_id]["coordinates"], self.esps[ref_id]["coordinates"]
+        )
+        if d <= PORTEE:
+            self.distances[node_id][ref_id] = d
+            self._couverts[ref_id].add(node_id)
+            self.a_localiser.add(node_id)
+
+    def references(self):
+        """
+        Les ESPs de référence du réseau.
+        """
+        return list(self._refs.values())
+
+    def mettre_a_jour(self):
+        """
+        Recalibre les ESPs de référence et relocalise les ESPs affectés par les changements
+        depuis la dernière mise à jour.
+
+        Retourne les ids des ESPs recalibrés et ceux des ESPs relocalisés.
+        """
+        calibrated = self._calibrer()
+        located = set(self.a_localiser)
+        for node_id in located:
+            self._localiser(self.esps[node_id])
+        self.a_localiser.clear()
+        return (calibrated, located)
+
+    def _calibrer(self):
+        if not self.a_calibrer or len(self._refs) < 3:
+            return set()
+        ref_esps = self.references()
+        calibrated = set(self.a_calibrer)
+
+        # the same index, and so the same neighbours, as the calibration
+        index = SpatialIndex(ref_esps)
+        calibrage_references(
+            ref_esps,
+            epsilon=self.epsilon,
+            seed=self.seed,
+            workers=self.workers,
+            ids=calibrated,
+            index=index,
+        )
+        for ref_id in calibrated:
+            esp = self.esps[ref_id]
+            for old in self._voisins.get(ref_id, ()):
+                if old in self._calibres_par:
+                    self._calibres_par[old].discard(ref_id)
+            voisins = deux_plus_proches_voisins(esp, ref_esps, index)
+            self._voisins[ref_id] = [voisin["id"] for voisin in voisins]
+            for voisin in voisins:
+                self._calibres_par[voisin["id"]].add(ref_id)
+            self._rayons[ref_id] = max(
+                distance(esp["coordinates"], voisin["coordinates"])
+                for voisin in voisins
+            )
+        self.a_calibrer.clear()
+        return calibrated
+
+    def _localiser(self, esp):
+        """
+        Estime la position de `esp` à partir des ESPs de référence à portée.
+        """
+        in_range = self.distances[esp["id"]]
+        if not in_range:
+            esp.pop("predicted_position", None)
+            return
+        ref_esps = [self.esps[ref_id] for ref_id in in_range]
+        self.methode(
+            esp, ref_esps, list(in_range.values()), self.dims, **self.options
+        )
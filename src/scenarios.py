@@ -0,0 +1,201 @@
+# Génération de réseaux d'ESPs de grande taille.
+# Contrairement à `main.random_set`, tout les ESPs sont tirés d'un seul coup
+# par un générateur numpy initialisé par une graine, ce qui rend les réseaux reproductibles.
+
+import numpy as np
+from fleet import Fleet, PATH_LOSS_KEYS
+from utils import CSV_COLUMNS
+
+
+# default path loss parameters distributions, as used by `esp8266.new_esp`
+PATH_LOSS_DISTRIBUTIONS = {
+    "P0": ("uniforme", -65, -45),
+    "d0": ("constante", 1.0),
+    "gamma": ("uniforme", 2, 3),
+    "sigma": ("constante", 1.0),
+}
+
+
+def generer_reseau(
+    nb_references,
+    nb_noeuds,
+    dims,
+    *,
+    seed=None,
+    disposition="uniforme",
+    distributions=None,
+    dtype=np.float64,
+    **options,
+):
+    """
+    Génère un réseau de `nb_references` ESPs de référence et `nb_noeuds` ESPs à localiser dans `dims`.
+
+    `disposition` choisit le placement des ESPs (voir `placement`), `options` lui est transmis.
+    `distributions` permet de remplacer certaines des `PATH_LOSS_DISTRIBUTIONS`,
+    chaque distribution étant un tuple de la forme :
+    - ("constante", valeur)
+    - ("uniforme", minimum, maximum)
+    - ("normale", moyenne, écart-type)
+
+    Les ESPs de référence ont les identifiants 0 à `nb_references` - 1 et précèdent les autres.
+    Retourne une `fleet.Fleet`.
+    """
+    rng = np.random.default_rng(seed)
+    places = _placements(rng, nb_references, nb_noeuds, dims, disposition, **options)
+    return _bloc(
+        rng, 0, nb_references + nb_noeuds, nb_references, places, distributions, dtype
+    )
+
+
+def ecrire_reseau(
+    out_file,
+    nb_references,
+    nb_noeuds,
+    dims,
+    *,
+    seed=None,
+    disposition="uniforme",
+    distributions=None,
+    bloc=1 << 16,
+    **options,
+):
+    """
+    Génère un réseau comme `generer_reseau` et l'écrit au fur et à mesure dans le CSV
+    `out_file` (au format de `utils.read_csv`), par blocs d'au plus `bloc` ESPs.
+
+    Seul un bloc est en mémoire à la fois. Chaque bloc est tiré par un générateur
+    dérivé de `seed` et de son rang, le fichier ne dépend donc que de `seed` et des paramètres.
+    """
+    count = nb_references + nb_noeuds
+    (layout_stream, *streams) = np.random.SeedSequence(seed).spawn(
+        1 + (count + bloc - 1) // bloc
+    )
+    places = _placements(
+        np.random.default_rng(layout_stream),
+        nb_references,
+        nb_noeuds,
+        dims,
+        disposition,
+        **options,
+    )
+    with open(out_file, "w") as file:
+        file.write("#" + "\t".join(CSV_COLUMNS) + "\n")
+        for start, stream in zip(range(0, count, bloc), streams):
+            fleet = _bloc(
+                np.random.default_rng(stream),
+                start,
+                min(bloc, count - start),
+                nb_references,
+                places,
+                distributions,
+                np.float64,
+            )
+            _write_rows(file, fleet)
+
+
+def _placements(rng, nb_references, nb_noeuds, dims, disposition, **options):
+    """
+    Les placements (voir `placement`) des ESPs de référence et des autres ESPs.
+    """
+    # each kind of ESP gets its own grid, but they share the same clusters
+    if disposition == "grille":
+        return (
+            placement(rng, nb_references, dims, disposition, **options),
+            placement(rng, nb_noeuds, dims, disposition, **options),
+        )
+    place = placement(rng, nb_references + nb_noeuds, dims, disposition, **options)
+    return (place, place)
+
+
+def _bloc(rng, start, size, nb_references, places, distributions, dtype):
+    """
+    Les ESPs d'identifiants `start` à `start + size - 1`, sous forme d'une `fleet.Fleet`.
+    """
+    distributions = {**PATH_LOSS_DISTRIBUTIONS, **(distributions or {})}
+    ids = np.arange(start, start + size)
+    (place_references, place_noeuds) = places
+    # number of references in this block
+    references = min(max(nb_references - start, 0), size)
+    coords = np.concatenate(
+        (
+            place_references(rng, start, references),
+            place_noeuds(rng, start + references - nb_references, size - references),
+        )
+    )
+    return Fleet(
+        ids,
+        coords,
+        *(tirer(rng, size, distributions[key]) for key in PATH_LOSS_KEYS),
+        ids < nb_references,
+        dtype=dtype,
+    )
+
+
+def placement(rng, count, dims, disposition="uniforme", *, groupes=10, etalement=None):
+    """
+    Prépare le placement de `count` ESPs dans `dims` suivant `disposition` :
+    - "uniforme" : uniformément dans tout l'espace
+    - "groupes" : autour de `groupes` centres tirés uniformément (par `rng`), avec un écart-type
+    de `etalement` (par défaut un vingtième de la plus grande dimension)
+    - "grille" : aux noeuds d'une grille régulière couvrant l'espace
+
+    Retourne une fonction `place(rng, start, size)` donnant le tableau (size, 2) des positions
+    des ESPs de rangs `start` à `start + size - 1`.
+    """
+    (x0, y0, width, height) = dims
+    origin, extent = np.array([x0, y0]), np.array([width, height])
+
+    if disposition == "uniforme":
+        return lambda rng, start, size: origin + rng.random((size, 2)) * extent
+
+    if disposition == "groupes":
+        if etalement is None:
+            etalement = max(width, height) / 20
+        centres = origin + rng.random((groupes, 2)) * extent
+
+        def place(rng, start, size):
+            points = centres[rng.integers(groupes, size=size)]
+            points += rng.normal(0, etalement, (size, 2))
+            return np.clip(points, origin, origin + extent)
+
+        return place
+
+    if disposition == "grille":
+        # as square as the space allows
+        columns = max(int(np.ceil(np.sqrt(count * width / height))), 1)
+        rows = int(np.ceil(count / columns))
+
+        def place(rng, start, size):
+            i, j = np.divmod(np.arange(start, start + size), columns)
+            return origin + (np.stack((j, i), axis=1) + 0.5) * extent / (columns, rows)
+
+        return place
+
+    raise ValueError(f"Unknown layout {disposition!r}")
+
+
+def tirer(rng, count, distribution):
+    """
+    Tire `count` valeurs suivant `distribution` (voir `generer_reseau`).
+    """
+    (kind, *params) = distribution
+    if kind == "constante":
+        return np.full(count, params[0], dtype=float)
+    if kind == "uniforme":
+        return rng.uniform(*params, count)
+    if kind == "normale":
+        return rng.normal(*params, count)
+    raise ValueError(f"Unknown distribution {kind!r}")
+
+
+def _write_rows(file, fleet):
+    columns = (
+        fleet.ids,
+        np.where(fleet.reference, "True", "False"),
+        fleet.coords[:, 0],
+        fleet.coords[:, 1],
+        *(getattr(fleet, key) for key in PATH_LOSS_KEYS),
+    )
+    file.writelines(
+        "\t".join(map(str, row)) + "\n" for row in zip(*(c.tolist() for c in columns))
+    )
@@ -0,0 +1,41 @@
+# Index spatial des ESPs.
+# Construit une seule fois pour un réseau, il permet de trouver les plus proches
+# voisins d'un ESP ou les ESPs à portée sans parcourir tout le réseau.
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class SpatialIndex:
+    """
+    Arbre k-d des positions d'un ensemble d'ESPs.
+
+    Les résultats des requêtes sont des indices dans `esps`, qui doit donc
+    conserver son ordre tant que l'index est utilisé.
+    """
+
+    def __init__(self, esps):
+        self.esps = esps
+        self.coords = np.array(
+            [esp["coordinates"] for esp in esps], dtype=float
+        ).reshape(-1, 2)
+        self.tree = cKDTree(self.coords)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def plus_proches_voisins(self, pos, k):
+        """
+        Les indices des `k` ESPs les plus proches de `pos`, du plus proche au plus lointain.
+        """
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=int)
+        _, indices = self.tree.query(pos, k=k)
+        return np.atleast_1d(indices)
+
+    def dans_le_rayon(self, pos, rayon):
+        """
+        Les indices (triés) des ESPs situés à une distance inférieure ou égale à `rayon` de `pos`.
+        """
+        return np.array(sorted(self.tree.query_ball_point(pos, rayon)), dtype=int)
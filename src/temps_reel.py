@@ -0,0 +1,212 @@
+# Localisation en continu.
+# Plutôt que de calibrer, de mesurer toutes les distances puis de localiser une fois,
+# les mesures (émetteur, receveur, puissance) sont traitées au fil de l'eau : chacune est
+# convertie en distance grâce aux caractéristiques estimées de l'ESP de référence,
+# puis corrige la position estimée du noeud par un filtre de Kalman étendu.
+# Chaque mesure demande un travail constant et la mémoire ne dépend que du nombre de noeuds.
+
+from math import hypot, log
+import numpy as np
+import matrices
+from esp8266 import PORTEE, reference_nodes
+from methods import DISTANCE_MIN, methode_gradient
+
+
+class _Noeud:
+    """
+    État du suivi d'un noeud : sa position estimée (x, y) et la covariance de l'erreur
+    sur cette position, une matrice symétrique [[pxx, pxy], [pxy, pyy]].
+
+    Tant que le filtre n'est pas initialisé, les distances aux ESPs de référence sont
+    gardées dans `premieres` (id de l'ESP de référence -> (distance, variance)).
+    """
+
+    __slots__ = ("x", "y", "pxx", "pxy", "pyy", "premieres")
+
+    def __init__(self):
+        self.x = self.y = None
+        self.pxx = self.pxy = self.pyy = 0.0
+        self.premieres = {}
+
+
+class SuiviTempsReel:
+    """
+    Suivi en continu de la position des noeuds à partir de mesures de puissance.
+
+    Une mesure est un tuple (id de l'émetteur, id du receveur, puissance en dBm) dont l'un
+    des ESPs est de référence (parmi `ref_esps`) et calibré ("estimated_path_loss_params",
+    voir `esp8266.calibrage_references`) et l'autre un noeud à localiser.
+
+    La puissance est convertie en distance suivant le modèle de l'ESP de référence, puis
+    la position du noeud est corrigée par un filtre de Kalman étendu, la position suivant
+    une marche aléatoire de variance `bruit_deplacement` (en m²) par mesure.
+    Les premières mesures d'un noeud servent à l'initialiser par `methods.methode_gradient`,
+    dès que `references_initiales` ESPs de référence distincts l'ont mesuré.
+    """
+
+    def __init__(
+        self,
+        ref_esps,
+        dims,
+        *,
+        bruit_deplacement=0.01,
+        references_initiales=3,
+        **options,
+    ):
+        # reference id -> (x, y, estimated parameters, sigma), what a measure needs
+        self.references = {
+            ref_esp["id"]: (
+                *ref_esp["coordinates"],
+                dict(ref_esp["estimated_path_loss_params"]),
+                ref_esp["path_loss_params"]["sigma"],
+            )
+            for ref_esp in ref_esps
+            if "estimated_path_loss_params" in ref_esp
+        }
+        self.dims = dims
+        self.bruit_deplacement = bruit_deplacement
+        self.references_initiales = references_initiales
+        # passed to `methode_gradient`
+        self.options = options
+        self.noeuds = {}
+
+    def position(self, identifier):
+        """
+        La position estimée du noeud `identifier`, `None` s'il n'est pas encore localisé.
+        """
+        noeud = self.noeuds.get(identifier)
+        if noeud is None or noeud.x is None:
+            return None
+        return (noeud.x, noeud.y)
+
+    def mesure(self, emetteur, receveur, puissance):
+        """
+        Prend en compte la mesure `puissance` (dBm) entre `emetteur` et `receveur` (des ids).
+
+        Retourne un tuple (id du noeud, position estimée) si la position du noeud a changé,
+        `None` sinon (mesure sans ESP de référence calibré, ou noeud pas encore initialisé).
+        """
+        if emetteur in self.references:
+            (ref_id, node_id) = (emetteur, receveur)
+        elif receveur in self.references:
+            (ref_id, node_id) = (receveur, emetteur)
+        else:
+            return None
+
+        (rx, ry, params, sigma) = self.references[ref_id]
+        d = float(matrices.distances_rssi(puissance, params))
+        # the error on the power, propagated to the distance
+        variance = (d * log(10) * sigma / (10 * params["gamma"])) ** 2
+
+        noeud = self.noeuds.get(node_id)
+        if noeud is None:
+            noeud = self.noeuds[node_id] = _Noeud()
+        if noeud.x is None:
+            noeud.premieres[ref_id] = (d, variance)
+            if len(noeud.premieres) < self.references_initiales:
+                return None
+            self._initialiser(noeud)
+        else:
+            self._corriger(noeud, rx, ry, d, variance)
+        return (node_id, (noeud.x, noeud.y))
+
+    def _initialiser(self, noeud):
+        """
+        Initialise le filtre de `noeud` à partir de ses premières distances.
+        """
+        ids = list(noeud.premieres)
+        ref_esps = [{"coordinates": self.references[ref_id][:2]} for ref_id in ids]
+        distances = [noeud.premieres[ref_id][0] for ref_id in ids]
+        esp = {}
+        methode_gradient(esp, ref_esps, distances, self.dims, **self.options)
+        (noeud.x, noeud.y) = esp["predicted_position"]
+        # as uncertain as the distances it comes from
+        variance = sum(v for _, v in noeud.premieres.values()) / len(ids)
+        (noeud.pxx, noeud.pxy, noeud.pyy) = (variance, 0.0, variance)
+        noeud.premieres = None
+
+    def _corriger(self, noeud, rx, ry, d, variance):
+        """
+        Une étape de prédiction et de correction du filtre de Kalman étendu de `noeud`,
+        pour la distance `d` (de variance `variance`) à l'ESP de référence en (`rx`, `ry`).
+        """
+        # prediction, the node may have moved
+        pxx = noeud.pxx + self.bruit_deplacement
+        pyy = noeud.pyy + self.bruit_deplacement
+        pxy = noeud.pxy
+
+        # the measure is the distance, linearised around the current estimate
+        dx, dy = noeud.x - rx, noeud.y - ry
+        rho = max(hypot(dx, dy), DISTANCE_MIN)
+        hx, hy = dx / rho, dy / rho
+
+        # P.H^T, the innovation variance and the gain
+        phx = pxx * hx + pxy * hy
+        phy = pxy * hx + pyy * hy
+        s = hx * phx + hy * phy + variance
+        kx, ky = phx / s, phy / s
+
+        innovation = d - rho
+        noeud.x += kx * innovation
+        noeud.y += ky * innovation
+        # (I - K.H).P, kept symmetric
+        noeud.pxx = pxx - kx * phx
+        noeud.pxy = pxy - kx * phy
+        noeud.pyy = pyy - ky * phy
+
+    def suivre(self, mesures):
+        """
+        Générateur des mises à jour (id du noeud, position estimée) produites par
+        l'itérable `mesures`, au fur et à mesure.
+        """
+        for mesure in mesures:
+            update = self.mesure(*mesure)
+            if update is not None:
+                yield update
+
+    async def suivre_async(self, mesures):
+        """
+        Version asynchrone de `suivre`, pour un itérable asynchrone de `mesures`.
+        """
+        async for mesure in mesures:
+            update = self.mesure(*mesure)
+            if update is not None:
+                yield update
+
+
+def mesures_simulees(esps, *, seed=None):
+    """
+    Générateur infini de mesures simulées, dans un ordre aléatoire, entre les ESPs de référence
+    (émetteurs) et les noeuds de `esps` à leur portée (voir `PORTEE`).
+
+    Les puissances suivent le modèle de `esp8266.signal_moyen`. Les mesures sont tirées
+    par paquets avec le générateur numpy initialisé par `seed`.
+    """
+    rng = np.random.default_rng(seed)
+    ref_esps = reference_nodes(esps)
+    (ids, coords) = matrices.noeuds(esps)
+    ids = np.array(ids, dtype=np.int64)
+    ref_ids = np.array([ref_esp["id"] for ref_esp in ref_esps], dtype=np.int64)
+    ref_coords = matrices.coordonnees(ref_esps)
+    params = matrices.caracteristiques(ref_esps)
+
+    # the links in range, node by node, found block by block
+    blocks = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=int), np.empty(0))]
+    for rows in matrices.blocs(len(coords), len(ref_esps)):
+        powers = matrices.matrice_puissances(
+            coords[rows], ref_coords, params, portee=PORTEE
+        )
+        # out of range powers are `nan`, and a node on its reference gets +inf
+        (nodes, refs) = np.nonzero(np.isfinite(powers))
+        blocks.append((ids[rows][nodes], refs, powers[nodes, refs]))
+    (receveurs, refs, means) = (np.concatenate(parts) for parts in zip(*blocks))
+    if not len(means):
+        return
+
+    (emetteurs, sigmas) = (ref_ids[refs], params["sigma"][refs])
+    while True:
+        picks = rng.integers(len(means), size=4096)
+        powers = matrices.rssi(means[picks], sigmas[picks], rng)
+        yield from zip(
+            emetteurs[picks].tolist(), receveurs[picks].tolist(), powers.tolist()
+        )
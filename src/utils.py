@@ -3,7 +3,9 @@
 # ainsi que des algoruithmes de géolocalisation.
 
 from math import sqrt, log10
+from itertools import islice
 import random
+import numpy as np
 
 
 def read_csv(file_name):
@@ -15,14 +17,23 @@ def read_csv(file_name):
     """
     esps = []
     try:
-        with open(file_name, "r") as file:
-            for line in file.readlines():
-                if line.startswith("#"):
-                    continue
-                line = line.strip("\n")
-                morsels = line.split("\t")
-                # décomposition par lignes et colonnes
-                esps.append(esp_from_string(morsels))
+        for columns in iter_csv(file_name):
+            for identifier, ref, x, y, P0, d0, gamma, sigma in zip(
+                *(columns[name].tolist() for name in CSV_COLUMNS)
+            ):
+                esps.append(
+                    {
+                        "path_loss_params": {
+                            "sigma": sigma,
+                            "gamma": gamma,
+                            "d0": d0,
+                            "P0": P0,
+                        },
+                        "coordinates": (x, y),
+                        "reference_node": ref,
+                        "id": identifier,
+                    }
+                )
 
     except Exception as e:
         print("Erreur de lecture du fichier : ", file_name)
@@ -31,6 +42,55 @@ def read_csv(file_name):
     return esps
 
 
+# columns of the network description files, in order
+CSV_COLUMNS = ("id", "ref", "x", "y", "P0", "d0", "gamma", "sigma")
+
+
+def iter_csv(file_name, chunksize=1 << 16):
+    """
+    Lit le CSV `file_name` (voir `read_csv`) par blocs d'au plus `chunksize` lignes.
+
+    Chaque bloc est un dictionnaire associant à chaque nom de `CSV_COLUMNS` un tableau numpy
+    de la colonne correspondante, convertie d'un seul coup. La mémoire utilisée ne dépend
+    que de `chunksize` et non de la taille du fichier.
+
+    Lève une `ValueError` indiquant le bloc fautif si une ligne est mal formée.
+    """
+    with open(file_name, "r") as file:
+        first_line = 1
+        while lines := list(islice(file, chunksize)):
+            rows = [
+                line.rstrip("\n").split("\t")
+                for line in lines
+                if not line.startswith("#") and line.strip()
+            ]
+            if rows:
+                try:
+                    yield _parse_columns(rows)
+                except ValueError as e:
+                    last_line = first_line + len(lines) - 1
+                    raise ValueError(
+                        f"{file_name}, lines {first_line}-{last_line}: {e}"
+                    ) from e
+            first_line += len(lines)
+
+
+def _parse_columns(rows):
+    """
+    Convertit les lignes `rows` (listes de str) en colonnes numpy.
+    """
+    if any(len(row) != len(CSV_COLUMNS) for row in rows):
+        raise ValueError(f"every row must have {len(CSV_COLUMNS)} columns")
+    (identifier, ref, *floats) = zip(*rows)
+    columns = {
+        "id": np.array(identifier, dtype=np.int64),
+        "ref": np.array(ref) == "True",
+    }
+    for name, values in zip(CSV_COLUMNS[2:], floats):
+        columns[name] = np.array(values, dtype=float)
+    return columns
+
+
 def esp_from_string(morsels):
     """
     Construit un esp à partir d'une liste de str représentant les caractéristiques de l'esp.
@@ -90,6 +150,22 @@ def get_signals(amount: int, mean, sigma):
     return [random.gauss(mean, sigma) for _ in range(amount)]
 
 
+def stream_signals(stats, rng, amount: int, mean, sigma, *, chunk=1 << 16):
+    """
+    Génère `amount` signaux et les ajoute au fur et à mesure à `stats`.
+
+    Les modalités de génération des signaux sont les mêmes que pour `get_signals`, mais
+    les tirages sont vectorisés et effectués par le générateur numpy `rng`.
+    Ils sont faits par blocs d'au plus `chunk` valeurs pour borner la mémoire utilisée.
+    `stats` est un `RunningStats`.
+    """
+
+    while amount > 0:
+        count = min(amount, chunk)
+        stats.update(rng.normal(mean, sigma, count))
+        amount -= count
+
+
 def get_signal_from_esp(esp, distance):
     """
     Génère un signal à partir des caractéristiques de `esp`.
@@ -105,6 +181,20 @@ def get_signal_from_esp(esp, distance):
     return P0 - 10 * gamma * log10(distance / d0) + random.gauss(0, sigma)
 
 
+def signal_traces(esp, distances, amount: int, rng):
+    """
+    Génère `amount` signaux successifs de `esp` pour chacune des `distances`.
+
+    Les modalités de génération des signaux sont les mêmes que pour `get_signal_from_esp`,
+    mais les tirages sont vectorisés et effectués par le générateur numpy `rng`.
+    Retourne un tableau (len(distances), amount), une ligne par distance.
+    """
+    params = esp["path_loss_params"]
+    distances = np.asarray(distances, dtype=float)
+    means = params["P0"] - 10 * params["gamma"] * np.log10(distances / params["d0"])
+    return means[:, None] + rng.normal(0, params["sigma"], (len(distances), amount))
+
+
 def expectancy(values):
     """
     L'espérance d'un ensemble de puissances.
@@ -118,6 +208,47 @@ def expectancy(values):
     return sum(values) / len(values)
 
 
+class RunningStats:
+    """
+    Espérance et variance d'un flux de puissances, calculées au fil de l'eau.
+
+    Il s'agit de l'algorithme de Welford, généralisé à l'ajout de plusieurs valeurs
+    à la fois. Seuls le nombre de valeurs, leur moyenne et la somme des carrés des écarts
+    à la moyenne sont conservés : la mémoire utilisée ne dépend pas du nombre de valeurs.
+    """
+
+    __slots__ = ("count", "mean", "_m2")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, values):
+        """
+        Ajoute le tableau `values` aux valeurs déjà observées.
+        """
+        values = np.asarray(values, dtype=float)
+        added = values.size
+        if added == 0:
+            return
+
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        total = self.count + added
+        delta = batch_mean - self.mean
+        self.mean += delta * added / total
+        self._m2 += batch_m2 + delta * delta * self.count * added / total
+        self.count = total
+
+    @property
+    def variance(self):
+        """
+        La variance des valeurs observées (0 s'il n'y en a pas).
+        """
+        return self._m2 / self.count if self.count else 0.0
+
+
 def variance(values):
     """
     La variance d'un ensemble de puissances.
@@ -168,6 +299,25 @@ def into_corners(dims):
     return corners
 
 
+def subdivide(cells, n=2):
+    """
+    Divise chacun des espaces rectangulaires de `cells` en une grille de `n` x `n` cellules.
+
+    `cells` est un tableau (K, 4) dont chaque ligne a la structure de `dims` (voir `into_corners`).
+    Pour `n` = 2 on retrouve les coins de `into_corners`, dans le même ordre.
+
+    Retourne un tableau (K * n * n, 4), les cellules d'un même espace étant consécutives.
+    """
+
+    cells = np.asarray(cells, dtype=float).reshape(-1, 4)
+    i, j = np.divmod(np.arange(n * n), n)
+    x0, y0 = cells[:, 0, None], cells[:, 1, None]
+    w, h = cells[:, 2, None] / n, cells[:, 3, None] / n
+    return np.stack(
+        np.broadcast_arrays(x0 + i * w, y0 + j * h, w, h), axis=-1
+    ).reshape(-1, 4)
+
+
 def middle_rect(dims):
     """
     Le milieu d'un espace rectangulaire
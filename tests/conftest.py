@@ -0,0 +1,6 @@
+# The modules of `src` import each other as top-level modules (see `main.py`).
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
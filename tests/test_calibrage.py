@@ -0,0 +1,42 @@
+# Le calibrage des ESPs de référence ne dépend que de la graine : chaque lien a son propre
+# générateur (voir `esp8266.link_rng`), quel que soit le nombre de processus ou le pilote.
+
+import copy
+import pytest
+from esp8266 import calibrage_references
+from pilotes import PiloteSimule, PiloteTCP, serveur_simule
+from scenarios import generer_reseau
+
+
+SEED = 7
+
+
+@pytest.fixture
+def esps():
+    return generer_reseau(20, 10, (0.0, 0.0, 40.0, 40.0), seed=3).to_esps()
+
+
+def calibrer(esps, **options):
+    esps = copy.deepcopy(esps)
+    metrics = {}
+    calibrage_references(esps, metrics=metrics, **options)
+    params = [esp.get("estimated_path_loss_params") for esp in esps]
+    return params, metrics
+
+
+def test_workers(esps):
+    (params, metrics) = calibrer(esps, seed=SEED, workers=1)
+    assert all(p is not None for p, esp in zip(params, esps) if esp["reference_node"])
+    assert calibrer(esps, seed=SEED, workers=3) == (params, metrics)
+
+
+def test_pilote_simule(esps):
+    local = calibrer(esps, seed=SEED)
+    assert calibrer(esps, pilote=PiloteSimule(SEED)) == local
+
+
+def test_pilote_tcp(esps):
+    local = calibrer(esps, seed=SEED)
+    with serveur_simule(esps, seed=SEED) as server:
+        pilote = PiloteTCP(server.host, server.port, connexions=4)
+        assert calibrer(esps, pilote=pilote) == local
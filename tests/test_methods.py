@@ -0,0 +1,62 @@
+# La localisation répartie entre processus ou threads doit donner exactement
+# les résultats de la localisation séquentielle.
+
+import copy
+import pytest
+from esp8266 import distances_reseau
+from methods import (
+    apply_method,
+    apply_method_parallel,
+    methode_gradient,
+    methode_partition,
+)
+from scenarios import generer_reseau
+
+
+@pytest.mark.parametrize("backend", ["process", "thread"])
+@pytest.mark.parametrize(
+    "dims, methode, options",
+    [
+        ((0.0, 0.0, 100.0, 100.0), methode_gradient, {"methode": "BFGS"}),
+        # sparse: most nodes are out of range of every reference
+        ((0.0, 0.0, 300.0, 300.0), methode_partition, {}),
+    ],
+)
+def test_apply_method_parallel(backend, dims, methode, options):
+    esps = generer_reseau(20, 120, dims, seed=5).to_esps()
+    ref_esps = [esp for esp in esps if esp["reference_node"]]
+    distances = distances_reseau(esps, ref_esps)
+
+    expected = copy.deepcopy(esps)
+    skipped = apply_method(expected, ref_esps, distances, dims, methode, **options)
+    located = copy.deepcopy(esps)
+    assert (
+        apply_method_parallel(
+            located,
+            ref_esps,
+            distances,
+            dims,
+            methode,
+            backend=backend,
+            workers=3,
+            chunksize=7,
+            **options,
+        )
+        == skipped
+    )
+    assert [esp.get("predicted_position") for esp in located] == [
+        esp.get("predicted_position") for esp in expected
+    ]
+
+
+def test_erreurs_propagees():
+    dims = (0.0, 0.0, 100.0, 100.0)
+    esps = generer_reseau(20, 20, dims, seed=5).to_esps()
+    ref_esps = [esp for esp in esps if esp["reference_node"]]
+    distances = distances_reseau(esps, ref_esps)
+    with pytest.raises(ValueError, match="typo"):
+        apply_method(esps, ref_esps, distances, dims, methode_gradient, depart="typo")
+    with pytest.raises(ValueError, match="typo"):
+        apply_method_parallel(
+            esps, ref_esps, distances, dims, methode_gradient, workers=2, depart="typo"
+        )
@@ -0,0 +1,57 @@
+# Un `Reseau` tenu à jour de façon incrémentale doit donner les mêmes résultats
+# qu'un réseau reconstruit entièrement à partir des mêmes ESPs.
+
+import copy
+from reseau import Reseau
+from scenarios import generer_reseau
+
+
+DIMS = (0.0, 0.0, 100.0, 100.0)
+SEED = 7
+
+
+def reconstruit(reseau):
+    fresh = Reseau(DIMS, copy.deepcopy(list(reseau.esps.values())), seed=SEED)
+    for esp in fresh.esps.values():
+        esp.pop("estimated_path_loss_params", None)
+        esp.pop("predicted_position", None)
+    fresh.mettre_a_jour()
+    return fresh
+
+
+def assert_identiques(reseau):
+    fresh = reconstruit(reseau)
+    assert reseau.distances == fresh.distances
+    for identifier, esp in reseau.esps.items():
+        for key in ("estimated_path_loss_params", "predicted_position"):
+            assert esp.get(key) == fresh.esps[identifier].get(key), (identifier, key)
+
+
+def test_modifications():
+    esps = generer_reseau(40, 150, DIMS, seed=4).to_esps()
+    reseau = Reseau(DIMS, copy.deepcopy(esps), seed=SEED)
+    reseau.mettre_a_jour()
+    assert_identiques(reseau)
+
+    ref_id = next(esp["id"] for esp in esps if esp["reference_node"])
+    node_id = next(esp["id"] for esp in esps if not esp["reference_node"])
+    changes = [
+        lambda: reseau.deplacer(node_id, (10.0, 10.0)),
+        lambda: reseau.deplacer(ref_id, (50.0, 50.0)),
+        lambda: reseau.ajouter(
+            {
+                "id": 999,
+                "reference_node": True,
+                "coordinates": (30.0, 40.0),
+                "path_loss_params": {"P0": -50.0, "d0": 1.0, "gamma": 2.5, "sigma": 1.0},
+            }
+        ),
+        lambda: reseau.modifier(ref_id, P0=-60.0),
+        lambda: reseau.retirer(999),
+        lambda: reseau.retirer(node_id),
+        lambda: reseau.retirer(ref_id),
+    ]
+    for change in changes:
+        change()
+        reseau.mettre_a_jour()
+        assert_identiques(reseau)